@@ -0,0 +1,167 @@
+"""
+Replays recorded video, or a directory of images, through the scan pipeline,
+without a webcam or a Kivy window.
+
+    python benchmark.py recording.mp4 --face-detection
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from simplecamera.constants import HD
+from simplecamera.lib.binarize import PARALLEL_BINARIZATIONS, VALID_BINARIZATIONS
+from simplecamera.lib.metrics import stage_metrics
+from simplecamera.lib.scanner import Scanner
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+PERCENTILES = (50, 95, 99)
+
+
+def get_frames(path, limit=None):
+    """Yields BGR frames, resized to HD."""
+    total = 0
+    if os.path.isdir(path):
+        filenames = sorted(
+            filename
+            for filename in os.listdir(path)
+            if filename.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        frames = (cv2.imread(os.path.join(path, filename)) for filename in filenames)
+    else:
+        frames = read_video(path)
+    for frame in frames:
+        if frame is None:
+            continue
+        if limit is not None and total >= limit:
+            break
+        height, width = frame.shape[:2]
+        if (width, height) != HD:
+            frame = cv2.resize(frame, HD, interpolation=cv2.INTER_AREA)
+        total += 1
+        yield frame
+
+
+def read_video(path):
+    capture = cv2.VideoCapture(path)
+    try:
+        while True:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def get_peak_rss():
+    """Megabytes, or None."""
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes on Linux
+        if sys.platform == "darwin":
+            return peak_rss / 1024 / 1024
+        return peak_rss / 1024
+
+
+def report(total_frames, total_qrcodes, total_faces, elapsed_time):
+    print("Frames      {}".format(total_frames))
+    if total_frames:
+        print("Frames/sec  {:.1f}".format(total_frames / elapsed_time))
+        print("QR codes    {:.1%}".format(total_qrcodes / total_frames))
+        print("Faces       {:.1%}".format(total_faces / total_frames))
+    peak_rss = get_peak_rss()
+    if peak_rss is not None:
+        print("Peak RSS    {:.1f}MB".format(peak_rss))
+    header = "".join("{:>10}".format("p{}".format(p)) for p in PERCENTILES)
+    print("\n{:<20}{:>8}{}".format("Stage (ms)", "calls", header))
+    # Recorded by the scanner, as in the app
+    for stage, summary in sorted(stage_metrics.get_summary().items()):
+        values = stage_metrics.get_percentiles(stage, PERCENTILES)
+        row = "".join("{:>10.2f}".format(value) for value in values)
+        print("{:<20}{:>8}{}".format(stage, summary["count"], row))
+    totals = stage_metrics.get_totals()
+    if totals:
+        print("\n{:<36}{:>12}".format("Counter", "total"))
+        for counter, total in sorted(totals.items()):
+            print("{:<36}{:>12}".format(counter, round(total, 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", help="Video file, or directory of images")
+    parser.add_argument("--limit", type=int, help="Maximum number of frames")
+    parser.add_argument("--left", action="store_true", help="Scan left card area")
+    parser.add_argument("--face-detection", action="store_true")
+    parser.add_argument("--face-recognition", action="store_true")
+    parser.add_argument("--face-detector", default="haar", choices=("haar", "dnn"))
+    parser.add_argument("--face-working-size", type=int, default=285)
+    parser.add_argument("--face-scale-factor", type=float, default=1.1)
+    parser.add_argument(
+        "--face-interval", type=int, default=1, help="Detect faces every Nth scan"
+    )
+    parser.add_argument("--motion-gating", action="store_true")
+    parser.add_argument("--qrcode-voting", action="store_true")
+    parser.add_argument("--parallel-binarization", action="store_true")
+    parser.add_argument(
+        "--parallel-binarizations",
+        nargs="+",
+        default=list(PARALLEL_BINARIZATIONS),
+        choices=sorted(VALID_BINARIZATIONS),
+    )
+    parser.add_argument(
+        "--gray", action="store_true", help="Scan grayscale, as with raw YUV capture"
+    )
+    parser.add_argument(
+        "--sequential", action="store_true", help="Decode card areas one at a time"
+    )
+    parser.add_argument(
+        "--max-samples", type=int, default=10000, help="Samples per stage"
+    )
+    args = parser.parse_args()
+
+    # Before the first sample, as the ring buffers are sized then
+    stage_metrics.max_samples = args.max_samples
+    scanner = Scanner()
+    scanner.set_resolution(HD)
+    scanner.face_working_size = args.face_working_size
+    scanner.set_face_detector(args.face_detector, scale_factor=args.face_scale_factor)
+    # Same options, and executor, as the app's ScanWorker
+    options = {
+        "is_left_scanning_active": args.left,
+        "is_face_detection_active": args.face_detection or args.face_recognition,
+        "is_face_recognition_active": args.face_recognition,
+        "is_motion_gating_active": args.motion_gating,
+        "is_qrcode_voting_active": args.qrcode_voting,
+        "is_parallel_binarization_active": args.parallel_binarization,
+        "parallel_binarizations": tuple(args.parallel_binarizations),
+        "face_interval": args.face_interval,
+    }
+    executor = None if args.sequential else ThreadPoolExecutor(max_workers=2)
+    total_frames = total_qrcodes = total_faces = 0
+    start_time = time.perf_counter()
+    for frame in get_frames(args.path, limit=args.limit):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if args.gray else None
+        with stage_metrics.time("scan"):
+            result = scanner.scan(frame, options, executor=executor, gray=gray)
+        total_frames += 1
+        total_qrcodes += 1 if result["qrcode"] else 0
+        total_faces += 1 if result["face"] is not None else 0
+    elapsed_time = time.perf_counter() - start_time
+    if executor is not None:
+        executor.shutdown()
+    scanner.close()
+    report(total_frames, total_qrcodes, total_faces, elapsed_time)
+
+
+if __name__ == "__main__":
+    main()
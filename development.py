@@ -1,13 +1,18 @@
+import multiprocessing
 import os
 
-# b/c pyinstaller
-try:
-    os.environ["KIVY_WINDOW"] = "sdl2,pygame"
-    os.environ["KIVY_IMAGE"] = "pil,sdl2"
-    os.environ["KIVY_AUDIO"] = "pygame,sdl2"
-except Exception:
-    pass
-else:
+# Scan processes are spawned, and re-import this module as __mp_main__, so Kivy,
+# which opens a window on import, must only be imported in the main process
+if __name__ == "__main__":
+    # b/c pyinstaller, for scan processes
+    multiprocessing.freeze_support()
+    # b/c pyinstaller
+    try:
+        os.environ["KIVY_WINDOW"] = "sdl2,pygame"
+        os.environ["KIVY_IMAGE"] = "pil,sdl2"
+        os.environ["KIVY_AUDIO"] = "pygame,sdl2"
+    except Exception:
+        pass
     from kivy.config import Config
 
     from simplecamera.app import SimpleCamera
@@ -15,7 +20,6 @@ else:
     # Copied from tendo, b/c pbr build errors
     from simplecamera.lib import singleton
 
-if __name__ == "__main__":
     Config.set("kivy", "desktop", 1)
     # Config.set("kivy", "window_icon", "assets/icon.ico")
     Config.set("kivy", "pause_on_minimize", 1)
@@ -1,11 +1,12 @@
+import os
 from datetime import datetime
 
-import cv2
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.factory import Factory
 from kivy.properties import (
     BooleanProperty,
+    ListProperty,
     NumericProperty,
     ObjectProperty,
     StringProperty,
@@ -13,6 +14,14 @@ from kivy.properties import (
 from kivymd.theming import ThemeManager
 
 from .constants import HD
+from .lib.cache import TTLCache
+from .lib.capture import FrameGrabber
+from .lib.facecache import FacePreviewCache
+from .lib.cardscan import CardScanUploader
+from .lib.metrics import stage_metrics
+from .lib.resources import get_data_dir
+from .lib.spool import CardScanSpool
+from .lib.sysmon import SystemMonitor
 from .mainwindow import MainWindow
 
 
@@ -20,6 +29,9 @@ class SimpleCamera(App):
     capture_request = ObjectProperty(allownone=True)
     capture_init = ObjectProperty(allownone=True)
     cpu = NumericProperty(0)
+    process_cpu = NumericProperty(0)
+    # Megabytes
+    memory = NumericProperty(0)
 
     scanner_name = StringProperty()
 
@@ -34,7 +46,12 @@ class SimpleCamera(App):
     total_connection_errors = NumericProperty(0)
 
     can_init_capture = BooleanProperty(False)
+    # First lane
     capture = ObjectProperty(allownone=True)
+    # Device indexes, or {"device": 1, "is_left_scanning_active": False}
+    camera_devices = ListProperty()
+    # One dict per lane, with device, and is_left_scanning_active
+    lanes = ListProperty([{"device": 0, "is_left_scanning_active": True}])
 
     is_hd = BooleanProperty(True)
     is_minimum_size = BooleanProperty(False)
@@ -46,7 +63,29 @@ class SimpleCamera(App):
     is_face_detection_active = BooleanProperty()
     is_face_helper_active = BooleanProperty(False)
     is_face_recognition_active = BooleanProperty()
+    is_motion_gating_active = BooleanProperty()
+    # Vote on QR codes over frames, alternating binarizations
+    is_qrcode_voting_active = BooleanProperty(True)
+    # Several binarizations per QR code region, on a thread pool
+    is_parallel_binarization_active = BooleanProperty(False)
+    parallel_binarizations = ListProperty(["adaptive_mean", "clahe_otsu", "gray"])
+    face_detector = StringProperty("haar")
+    face_working_size = NumericProperty(285)
+    face_scale_factor = NumericProperty(1.1)
+    # Scan in a child process, per lane
+    is_process_scanning = BooleanProperty(False)
+    # Capture format, as requested, and as negotiated by the first lane
+    camera_fourcc = StringProperty("MJPG", allownone=True)
+    camera_buffer_size = NumericProperty(1, allownone=True)
+    is_raw_yuv_capture = BooleanProperty(False)
+    capture_format = StringProperty()
+    # Card scan JPEG
+    upload_width = NumericProperty(640)
+    upload_quality = NumericProperty(75)
+    is_face_crop_upload = BooleanProperty(False)
     is_scanning_area_highlighted = BooleanProperty(False)
+    # 0 is best quality, higher when overloaded
+    quality_level = NumericProperty(0)
 
     is_debug_character_visible = BooleanProperty()
     debug_character_icon = StringProperty()
@@ -60,15 +99,42 @@ class SimpleCamera(App):
 
     def __init__(self, https=True, settings={}, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # By lane
+        self.captures = {}
         self.https = https
         # Settings
         self.settings = settings
+        # Sample cpu, and memory, off the main thread
+        self.system_monitor = SystemMonitor(interval=0.5)
+        self.system_monitor.start()
+        # Card scans are spooled to disk, then uploaded in the background
+        spool = CardScanSpool(os.path.join(get_data_dir(), "cardscan.sqlite3"))
+        self.uploader = CardScanUploader(spool)
+        self.uploader.start()
+        # Card text, by card number
+        self.user_cache = TTLCache()
+        # Face previews, by cardscan uuid
+        self.face_preview_cache = FacePreviewCache(get_data_dir("face-previews"))
         # Update cpu twice a second.
         Clock.schedule_interval(self.get_cpu, 0.5)
+        # Flush stage timings once a minute.
+        Clock.schedule_interval(self.flush_metrics, 60)
 
     def on_domain(self, instance, domain):
         self.url = self.get_url(domain)
 
+    def on_url(self, instance, url):
+        self.set_upload_request()
+
+    def on_token(self, instance, token):
+        self.set_upload_request()
+
+    def set_upload_request(self):
+        # Spooled scans are uploaded with the current domain, and token
+        if self.url:
+            url = self.url + "jinjuku-card/save/"
+            self.uploader.set_request(url, self.get_headers())
+
     def get_url(self, domain):
         if self.https:
             url = "https://{}/".format(domain)
@@ -102,7 +168,21 @@ class SimpleCamera(App):
         self.system_message_text = "インターネットの接続がありません。\nまたは、ドメイン名とパスワードの\n設定が間違いっています。"
 
     def get_cpu(self, *args):
-        self.cpu = None
+        self.process_cpu = round(self.system_monitor.process_cpu, 1)
+        self.memory = round(self.system_monitor.memory, 1)
+        cpu = round(self.system_monitor.cpu, 1)
+        if cpu == self.cpu:
+            # Capture requests are checked on every update
+            self.property("cpu").dispatch(self)
+        else:
+            self.cpu = cpu
+
+    def flush_metrics(self, *args):
+        path = os.path.join(get_data_dir(), "metrics.jsonl")
+        try:
+            stage_metrics.flush(path)
+        except OSError:
+            pass
 
     def on_cpu(self, instance, cpu):
         # Is token valid?
@@ -142,16 +222,44 @@ class SimpleCamera(App):
         self.system_message_header = "カメラ"
         self.system_message_text = "カメラを変更しています。"
         self.release_capture()
+        self.lanes = self.get_lanes()
+
+    def on_camera_devices(self, *args):
+        self.on_is_secondary_camera()
+
+    def get_lanes(self):
+        """One lane per camera device, or a single lane."""
+        lanes = []
+        for device in self.camera_devices:
+            if not isinstance(device, dict):
+                device = {"device": device}
+            lane = {"is_left_scanning_active": True}
+            lane.update(device)
+            lanes.append(lane)
+        if not lanes:
+            device = 1 if self.is_secondary_camera else 0
+            lanes.append({"device": device, "is_left_scanning_active": True})
+        return lanes
+
+    def get_lane_capture(self, lane):
+        return self.captures.get(lane)
 
     def get_capture(self, *args):
-        width, height = HD
         fps = 30
-        device = 1 if self.is_secondary_camera else 0
-        capture = cv2.VideoCapture(device)
-        capture.set(3, width)  # CV_CAP_PROP_FRAME_WIDTH
-        capture.set(4, height)  # CV_CAP_PROP_FRAME_HEIGHT
-        capture.set(5, fps)  # CV_CAP_PROP_FPS
-        self.capture = capture
+        for index, lane in enumerate(self.lanes):
+            # Grab frames on a dedicated thread, per device
+            capture = FrameGrabber(
+                lane["device"],
+                HD,
+                fps,
+                fourcc=self.camera_fourcc,
+                buffer_size=self.camera_buffer_size,
+                is_raw_yuv=self.is_raw_yuv_capture,
+            )
+            capture.start()
+            self.captures[index] = capture
+        self.capture = self.captures[0]
+        self.capture_format = self.get_capture_format(self.capture.negotiated)
         # Success
         self.capture_request = None
         self.capture_init = datetime.now()
@@ -159,10 +267,17 @@ class SimpleCamera(App):
         self.system_message_header = ""
         self.system_message_text = ""
 
+    def get_capture_format(self, negotiated):
+        width, height = negotiated["resolution"]
+        fourcc = negotiated["fourcc"].strip("\x00") or "?"
+        return "{}x{} {} {:.0f}fps".format(width, height, fourcc, negotiated["fps"])
+
     def release_capture(self):
         # Capture was initialized
         if self.capture is not None:
-            self.capture.release()
+            for capture in self.captures.values():
+                capture.release()
+            self.captures = {}
             self.capture = None
             self.capture_init = None
             self.is_scanning = False
@@ -181,8 +296,16 @@ class SimpleCamera(App):
         Factory.register("Card", module="simplecamera.card")
         Factory.register("CardHelper", module="simplecamera.cardhelper")
         Factory.register("SystemMessage", module="simplecamera.systemmessage")
+        Factory.register("Lane", module="simplecamera.lane")
         # Build
         return MainWindow()
 
     def on_stop(self):
+        # Scan workers, and child processes, of every lane
+        if self.root is not None:
+            self.root.release_lanes()
         self.release_capture()
+        self.system_monitor.stop()
+        # Unsent scans stay spooled, until the next start
+        self.uploader.stop()
+        self.face_preview_cache.close()
@@ -6,20 +6,18 @@ import os
 
 from kivy.clock import Clock
 from kivy.lang import Builder
-from kivy.network.urlrequest import UrlRequest
 from kivy.properties import BooleanProperty, ObjectProperty, StringProperty
 from kivy.uix.anchorlayout import AnchorLayout
 
-from appdirs import user_data_dir
 from jsondiff import diff
 
-from .lib.resources import get_filename
-from .mixins import NetworkRetryMixin, UTCMixin
+from .lib.resources import get_data_dir, get_filename
+from .mixins import HTTPRequestMixin, NetworkRetryMixin, UTCMixin
 
 Builder.load_file(get_filename("kv/appsettings.kv"))
 
 
-class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
+class AppSettings(UTCMixin, NetworkRetryMixin, HTTPRequestMixin, AnchorLayout):
     app = ObjectProperty()
     domain_request_init = ObjectProperty(allownone=True)
     token_request_init = ObjectProperty(allownone=True)
@@ -44,7 +42,7 @@ class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
         + "または接続障害5回以上だったの場合、自動的にオン[/size][/color]"
     )
     left_scanning_label = StringProperty(
-        "スキャン左右\n[color=#777777][size=10]パフォーマンスのためオフはお勧め[/size][/color]"
+        "スキャン左右\n[color=#777777][size=10]負荷が高い場合、自動的にオフ[/size][/color]"
     )
     face_detection_label = StringProperty(
         "顔検出\n[color=#777777][size=10]支払いが必要ない[/size][/color]"
@@ -52,6 +50,12 @@ class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
     face_recognition_label = StringProperty(
         "顔認識\n[color=#777777][size=10]支払いが必要[/size][/color]"
     )
+    motion_gating_label = StringProperty(
+        "動き検出\n[color=#777777][size=10]動きがない場合、スキャンしない[/size][/color]"
+    )
+    dnn_face_detector_label = StringProperty(
+        "DNN顔検出\n[color=#777777][size=10]モデルファイルが必要[/size][/color]"
+    )
     settings = ObjectProperty()
 
     def __init__(self, *args, **kwargs):
@@ -62,17 +66,7 @@ class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
         self.load_settings()
 
     def get_settings_path(self):
-        app_name = "JinjukuCamera"
-        app_author = "Jinjuku"
-        app_dir = user_data_dir(app_name, app_author)
-        # Create author_dir
-        author_dir, _ = os.path.split(app_dir)
-        if not os.path.exists(author_dir):
-            os.mkdir(author_dir)
-        # Create app_dir
-        if not os.path.exists(app_dir):
-            os.mkdir(app_dir)
-        settings_path = os.path.join(app_dir, "settings.json")
+        settings_path = os.path.join(get_data_dir(), "settings.json")
         # Create file
         if not os.path.exists(settings_path):
             with open(settings_path, "w"):
@@ -89,6 +83,30 @@ class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
             "is_left_scanning_active": True,
             "is_face_detection_active": True,
             "is_face_recognition_active": False,
+            "is_motion_gating_active": True,
+            # Accept QR codes over several frames, one binarization per frame
+            "is_qrcode_voting_active": True,
+            # Binarize concurrently, first valid QR code wins, tune per site
+            "is_parallel_binarization_active": False,
+            "parallel_binarizations": ["adaptive_mean", "clahe_otsu", "gray"],
+            # haar, or dnn
+            "face_detector": "haar",
+            # Width of the face area, when detecting faces. 0 is full resolution
+            "face_working_size": 285,
+            "face_scale_factor": 1.1,
+            # Card scan JPEG, upload only the detected face if is_face_crop_upload
+            "upload_width": 640,
+            "upload_quality": 75,
+            "is_face_crop_upload": False,
+            # One lane per device, is_secondary_camera is used if empty
+            "camera_devices": [],
+            # Scan in a child process per lane, to use more cores
+            "is_process_scanning": False,
+            # MJPG for HD at 30 fps over USB 2.0, or null for the default
+            "camera_fourcc": "MJPG",
+            "camera_buffer_size": 1,
+            # YUYV, with the Y plane as grayscale, overrides camera_fourcc
+            "is_raw_yuv_capture": False,
         }
 
     def load_settings(self):
@@ -117,6 +135,23 @@ class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
         self.app.is_face_recognition_active = self.get_setting(
             "is_face_recognition_active"
         )
+        self.app.is_motion_gating_active = self.get_setting("is_motion_gating_active")
+        self.app.is_qrcode_voting_active = self.get_setting("is_qrcode_voting_active")
+        self.app.is_parallel_binarization_active = self.get_setting(
+            "is_parallel_binarization_active"
+        )
+        self.app.parallel_binarizations = self.get_setting("parallel_binarizations")
+        self.app.face_detector = self.get_setting("face_detector")
+        self.app.face_working_size = self.get_setting("face_working_size")
+        self.app.face_scale_factor = self.get_setting("face_scale_factor")
+        self.app.upload_width = self.get_setting("upload_width")
+        self.app.upload_quality = self.get_setting("upload_quality")
+        self.app.is_face_crop_upload = self.get_setting("is_face_crop_upload")
+        self.app.camera_devices = self.get_setting("camera_devices")
+        self.app.is_process_scanning = self.get_setting("is_process_scanning")
+        self.app.camera_fourcc = self.get_setting("camera_fourcc")
+        self.app.camera_buffer_size = self.get_setting("camera_buffer_size")
+        self.app.is_raw_yuv_capture = self.get_setting("is_raw_yuv_capture")
 
     def get_setting(self, key):
         if key in self.app.settings:
@@ -161,7 +196,8 @@ class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
     def domain_request(self, *args):
         domain = self.ids["domain"].text
         url = self.app.get_url(domain)
-        UrlRequest(
+        self.http_request(
+            "GET",
             url + "jinjuku-card/scanner-ping/",
             on_success=self.domain_success,
             on_failure=self.domain_retry,
@@ -220,13 +256,14 @@ class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
     def token_request(self, *args):
         token = self.ids["token"].text
         headers = self.app.get_headers(token=token)
-        UrlRequest(
+        self.http_request(
+            "GET",
             self.app.url + "jinjuku-card/scanner-auth/",
             on_success=self.token_success,
             on_failure=self.token_retry,
             # Network error
             on_error=self.token_retry,
-            req_headers=headers,
+            headers=headers,
             timeout=3,
         )
 
@@ -304,6 +341,18 @@ class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
                     self.app.is_face_detection_active = True
             self.save_settings()
 
+    def toggle_is_motion_gating_active(self, is_active):
+        # True, False, None
+        if is_active is not None:
+            self.app.is_motion_gating_active = is_active
+            self.save_settings()
+
+    def toggle_is_dnn_face_detector(self, is_active):
+        # True, False, None
+        if is_active is not None:
+            self.app.face_detector = "dnn" if is_active else "haar"
+            self.save_settings()
+
     def can_save_settings(self):
         return (
             self.app.scanner_name
@@ -314,6 +363,19 @@ class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
             and self.app.is_left_scanning_active is not None
             and self.app.is_face_detection_active is not None
             and self.app.is_face_recognition_active is not None
+            and self.app.is_motion_gating_active is not None
+            and self.app.is_qrcode_voting_active is not None
+            and self.app.is_parallel_binarization_active is not None
+            and self.app.parallel_binarizations is not None
+            and self.app.face_detector is not None
+            and self.app.face_working_size is not None
+            and self.app.face_scale_factor is not None
+            and self.app.upload_width is not None
+            and self.app.upload_quality is not None
+            and self.app.is_face_crop_upload is not None
+            and self.app.camera_devices is not None
+            and self.app.is_process_scanning is not None
+            and self.app.is_raw_yuv_capture is not None
         )
 
     def get_current_settings(self):
@@ -326,6 +388,23 @@ class AppSettings(UTCMixin, NetworkRetryMixin, AnchorLayout):
             "is_left_scanning_active": (self.app.is_left_scanning_active),
             "is_face_detection_active": (self.app.is_face_detection_active),
             "is_face_recognition_active": (self.app.is_face_recognition_active),
+            "is_motion_gating_active": (self.app.is_motion_gating_active),
+            "is_qrcode_voting_active": self.app.is_qrcode_voting_active,
+            "is_parallel_binarization_active": (
+                self.app.is_parallel_binarization_active
+            ),
+            "parallel_binarizations": list(self.app.parallel_binarizations),
+            "face_detector": self.app.face_detector,
+            "face_working_size": self.app.face_working_size,
+            "face_scale_factor": self.app.face_scale_factor,
+            "upload_width": self.app.upload_width,
+            "upload_quality": self.app.upload_quality,
+            "is_face_crop_upload": self.app.is_face_crop_upload,
+            "camera_devices": list(self.app.camera_devices),
+            "is_process_scanning": self.app.is_process_scanning,
+            "camera_fourcc": self.app.camera_fourcc,
+            "camera_buffer_size": self.app.camera_buffer_size,
+            "is_raw_yuv_capture": self.app.is_raw_yuv_capture,
         }
 
     def save_settings(self):
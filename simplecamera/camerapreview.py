@@ -2,29 +2,25 @@
 from __future__ import absolute_import, unicode_literals
 
 import datetime
-from io import BytesIO
-from urllib.parse import urlencode
+from queue import Empty, Full
 
-import cv2
-import numpy as np
-from kivy.clock import Clock
+from kivy.clock import Clock, mainthread
 from kivy.core.audio import SoundLoader
 from kivy.lang import Builder
-from kivy.network.urlrequest import UrlRequest
 from kivy.properties import ObjectProperty, StringProperty
-from PIL import Image
 
 from .camera import KivyOpenCVCamera
 from .constants import GOLD_95, LIGHT_BLUE_95, LIGHTEST_BLUE_95, RED_95
-from .lib.cardscan import CardScanRequest
+from .lib.cache import get_max_age
+from .lib.facecache import decode_jpg
 from .lib.kqueue import KivyQueue
 from .lib.resources import get_filename
-from .mixins import NetworkRetryMixin, UTCMixin
+from .mixins import HTTPRequestMixin, NetworkRetryMixin, UTCMixin
 
 Builder.load_file(get_filename("kv/camerapreview.kv"))
 
 
-class CameraPreview(UTCMixin, NetworkRetryMixin, KivyOpenCVCamera):
+class CameraPreview(UTCMixin, NetworkRetryMixin, HTTPRequestMixin, KivyOpenCVCamera):
     app = ObjectProperty()
     request_init = ObjectProperty(allownone=True)
 
@@ -47,14 +43,17 @@ class CameraPreview(UTCMixin, NetworkRetryMixin, KivyOpenCVCamera):
         }
         # Numpy properties, which do not behave well with kivy's
         # property checking
-        self.frame = None
         self.face_preview = None
-        # Initialize queue
-        self.cardscan_queue = KivyQueue(self.cardscan_response, maxsize=1)
+        # Future, of JPEG bytes
+        self.frame_data = None
+        # Initialize queue, responses for spooled scans may arrive late
+        self.cardscan_queue = KivyQueue(self.cardscan_response)
+        # Key of the current scan, in the uploader
+        self.cardscan_key = None
 
-    def got_data(self, frame, qrcode, face_preview):
-        # Stop scanning
-        self.app.is_scanning = False
+    def got_data(self, frame, qrcode, face_preview, face=None):
+        # Stop scanning, in this lane
+        self.is_scanning = False
         self.face_helper_deactivate()
         # Datetime
         self.utc = self.get_utc()
@@ -64,12 +63,50 @@ class CameraPreview(UTCMixin, NetworkRetryMixin, KivyOpenCVCamera):
         if self.app.is_face_detection_active:
             self.body.color = GOLD_95
         # Save references
-        self.frame = frame.copy()
         self.face_preview = face_preview.copy()
+        # Encode now, while the user is looked up, frame is already a copy
+        self.frame_data = self.encode_upload(frame, face)
+        # Regulars, before the user request completes
+        self.show_cached_user()
+
+    def encode_upload(self, frame, face):
+        """The detected face, if is_face_crop_upload, otherwise the frame. The
+        face is never more pixels than the frame would be."""
+        width = self.app.upload_width
+        height, frame_width = frame.shape[:2]
+        max_area = width * height * width / frame_width
+        if self.app.is_face_crop_upload and face is not None:
+            x, y, w, h = face
+            frame = frame[y : y + h, x : x + w]
+        return self.app.uploader.encode(
+            frame, width=width, quality=self.app.upload_quality, max_area=max_area
+        )
+
+    def get_card_number(self):
+        # QR code is "card_number password"
+        return self.qrcode.split(" ")[0]
+
+    def show_cached_user(self):
+        data = self.app.user_cache.get(self.get_card_number())
+        if data is not None:
+            self.localtime = datetime.datetime.now()
+            self.set_card_text(data)
+            self.card.show_card()
+            self.card.blit_face(self.face_preview)
+
+    def cache_user(self, response, result):
+        """Cache card text, unless the server says otherwise."""
+        card_number = self.get_card_number()
+        max_age = get_max_age(response.headers)
+        if max_age == 0 or "line_1" not in result or "line_2" not in result:
+            self.app.user_cache.remove(card_number)
+        else:
+            data = {"line_1": result["line_1"], "line_2": result["line_2"]}
+            self.app.user_cache.set(card_number, data, ttl=max_age)
 
     def on_qrcode(self, *args):
         """Retry until CPU 75% or less, or 500ms have passed."""
-        if not self.app.is_scanning and not self.request_init:
+        if not self.is_scanning and not self.request_init:
             elapsed_time = self.get_elapsed_time(self.utc)
             milliseconds = elapsed_time * 1000
             # Is CPU 75% or less, or have 500ms passed
@@ -82,16 +119,22 @@ class CameraPreview(UTCMixin, NetworkRetryMixin, KivyOpenCVCamera):
 
     def user_request(self, *args):
         headers = self.app.get_headers(content_type="application/x-www-form-urlencoded")
-        UrlRequest(
+        self.http_request(
+            "POST",
             self.app.url + "jinjuku-card/user/",
             on_success=self.qrcode_result,
-            on_failure=self.user_request_error,
+            on_failure=self.user_request_failure,
             on_error=self.user_request_error,
-            req_body=urlencode({"qrcode": self.qrcode}),
-            req_headers=headers,
+            data={"qrcode": self.qrcode},
+            headers=headers,
             timeout=3,
         )
 
+    def user_request_failure(self, *args):
+        """The server answered with an error, so cached card text is stale."""
+        self.app.user_cache.remove(self.get_card_number())
+        self.user_request_error()
+
     def user_request_error(self, *args):
         self.retry_on_error(
             self.user_request, self.request_init, error=self.network_error
@@ -102,6 +145,7 @@ class CameraPreview(UTCMixin, NetworkRetryMixin, KivyOpenCVCamera):
         has_uuid = "cardscan_uuid" in result
         has_timestamp = "cardscan_timestamp" in result
         try:
+            self.cache_user(request, result)
             if has_uuid and has_timestamp:
                 self.get_face_preview(result)
             else:
@@ -116,20 +160,25 @@ class CameraPreview(UTCMixin, NetworkRetryMixin, KivyOpenCVCamera):
         )
         # Set card
         self.set_card_text(data)
-        # Face preview
-        self.request_init = self.get_utc()
-        self.face_preview_request()
+        # Face preview, from cache if possible
+        face_preview = self.app.face_preview_cache.get(self.cardscan_uuid)
+        if face_preview is not None:
+            self.show_face_preview(face_preview)
+        else:
+            self.request_init = self.get_utc()
+            self.face_preview_request()
 
     def face_preview_request(self, *args):
         # Get headers
         headers = self.app.get_headers(content_type="application/x-www-form-urlencoded")
-        UrlRequest(
+        self.http_request(
+            "POST",
             self.app.url + "card/face-preview/",
             on_success=self.face_preview_result,
             on_failure=self.face_preview_error,
             on_error=self.face_preview_error,
-            req_body=urlencode({"uuid": self.cardscan_uuid}),
-            req_headers=headers,
+            data={"uuid": self.cardscan_uuid},
+            headers=headers,
             timeout=3,
         )
 
@@ -140,23 +189,23 @@ class CameraPreview(UTCMixin, NetworkRetryMixin, KivyOpenCVCamera):
 
     def face_preview_result(self, request, result):
         try:
-            # Open as PIL image
-            inmemory_file = BytesIO(result)
-            with Image.open(inmemory_file) as image:
-                # Convert to array
-                face_preview = np.array(image)
-                # Convert to BGR
-                bgr = cv2.cvtColor(face_preview, cv2.COLOR_RGB2BGR)
+            # Decode to BGR
+            bgr = decode_jpg(result)
+            assert bgr is not None
         except Exception:
             self.decode_error()
         else:
-            self.face_preview = bgr
-            # Show card
-            self.card.show_card(background_color=LIGHTEST_BLUE_95)
-            # Show face
-            self.card.blit_face(self.face_preview)
-            # Play sound
-            self.sound = "done"
+            self.app.face_preview_cache.set(self.cardscan_uuid, result, bgr)
+            self.show_face_preview(bgr)
+
+    def show_face_preview(self, face_preview):
+        self.face_preview = face_preview
+        # Show card
+        self.card.show_card(background_color=LIGHTEST_BLUE_95)
+        # Show face
+        self.card.blit_face(self.face_preview)
+        # Play sound
+        self.sound = "done"
 
     def new_cardscan(self, data):
         # Set timestamp before uuid
@@ -197,6 +246,14 @@ class CameraPreview(UTCMixin, NetworkRetryMixin, KivyOpenCVCamera):
         self.card.text_block = "インターネット\nの接続\nがありません。"
         self.sound = "error"
 
+    def spooled_error(self):
+        """Scan is kept on disk, and uploaded when the network is back."""
+        self.app.total_connection_errors += 1
+        self.card.show_card()
+        self.card.header_block = "[color=#E7040F]エラー[/color]"
+        self.card.text_block = "接続がありません。\nスキャンは\n後で送信します。"
+        self.sound = "error"
+
     def decode_error(self):
         self.card.show_card()
         self.card.header_block = "[color=#E7040F]エラー[/color]"
@@ -209,31 +266,44 @@ class CameraPreview(UTCMixin, NetworkRetryMixin, KivyOpenCVCamera):
             self.cardscan_request()
 
     def cardscan_request(self):
-        url = self.app.url + "jinjuku-card/save/"
-        headers = self.app.get_headers()
-        cardscan = CardScanRequest(
-            self, url, headers, self.qrcode, self.utc, self.frame
-        )
-        cardscan.start()
+        # Spooled, then uploaded in the background
+        try:
+            self.cardscan_key = self.app.uploader.submit(
+                self.qrcode,
+                self.utc,
+                self.app.is_face_recognition_active,
+                self.frame_data,
+                callback=self.cardscan_queue.put,
+            )
+        except Full:
+            # Rejected, with OVERFLOW_REJECT, cleared once the sound plays
+            self.decode_error()
 
+    @mainthread
     def cardscan_response(self):
-        # Work with legacy API
-        data = self.cardscan_queue.get()[0]
-        if data:
-            if "network_error" in data:
-                self.retry_on_error(
-                    self.cardscan_request, self.request_init, error=self.network_error
-                )
+        while True:
+            try:
+                key, data = self.cardscan_queue.get()
+            except Empty:
+                break
             else:
-                # Play sound
-                if "sound" in data:
-                    sound = data["sound"]
-                    # TODO: Rename on server
-                    sound = "fail" if sound == "lock" else sound
-                    self.set_card_text(data, attention=True)
-                    self.sound = sound
+                # Scans from before, which were spooled
+                if key == self.cardscan_key:
+                    self.on_cardscan_data(data)
+
+    def on_cardscan_data(self, data):
+        if "network_error" in data:
+            self.spooled_error()
+        elif "sound" in data:
+            sound = data["sound"]
+            # TODO: Rename on server
+            sound = "fail" if sound == "lock" else sound
+            self.set_card_text(data, attention=True)
+            self.sound = sound
         else:
-            self.clear_request()
+            # Scan, upload, or response, error. A sound must play, so that
+            # scanning resumes
+            self.decode_error()
 
     def on_sound(self, instance, sound):
         if sound in self.sounds:
@@ -249,11 +319,12 @@ class CameraPreview(UTCMixin, NetworkRetryMixin, KivyOpenCVCamera):
     def clear_request_params(self):
         self.uuid = None
         self.cardscan_uuid = None
+        self.cardscan_key = None
         self.qrcode = None
         self.utc = None
         self.localtime = None
-        self.frame = None
         self.face_preview = None
+        self.frame_data = None
         # Clear last
         self.request_init = None
 
@@ -27,7 +27,7 @@ class Card(BoxLayout):
         self.header_block = ""
         self.text_block = ""
         self.footer_block = ""
-        self.app.is_scanning = True
+        self.camera.is_scanning = True
         # After reinitialize scanning
         self.camera.is_request_active = False
 
@@ -9,3 +9,4 @@ Builder.load_file(get_filename("kv/cardhelper.kv"))
 
 class CardHelper(BoxLayout):
     app = ObjectProperty()
+    camera = ObjectProperty()
@@ -8,6 +8,7 @@ from kivy.lang import Builder
 from kivy.properties import ObjectProperty, StringProperty
 from kivy.uix.anchorlayout import AnchorLayout
 
+from .lib.metrics import stage_metrics
 from .lib.resources import get_filename
 
 Builder.load_file(get_filename("kv/debugcharacter.kv"))
@@ -67,8 +68,31 @@ class DebugCharacter(AnchorLayout):
             cpu_string = dark_red.format(cpu_string)
         if fps <= 10:
             fps_string = dark_red.format(fps_string)
-        msg = "CPU {}\nFPS  {}\n{}"
-        self.message = msg.format(cpu_string, fps_string, failure_string)
+        memory_string = "{}MB".format(round(self.app.memory))
+        level_string = str(self.app.quality_level)
+        if self.app.quality_level > 0:
+            level_string = dark_red.format(level_string)
+        msg = "CPU {}\nMEM {}\nFPS  {}\nLVL {}\n{}\n{}\n{}"
+        stages_string = self.get_stages_message()
+        self.message = msg.format(
+            cpu_string,
+            memory_string,
+            fps_string,
+            level_string,
+            "[size=11]{}[/size]".format(self.app.capture_format),
+            failure_string,
+            stages_string,
+        )
+
+    def get_stages_message(self):
+        """p50/p95 per stage, in milliseconds."""
+        lines = []
+        for stage, summary in sorted(stage_metrics.get_summary().items()):
+            line = "{} {:.0f}/{:.0f}ms".format(stage, summary["p50"], summary["p95"])
+            lines.append(line)
+        upload_bytes = stage_metrics.get_totals().get("upload_bytes", 0)
+        lines.append("uploaded {:.1f}MB".format(upload_bytes / (1024 * 1024)))
+        return "[size=11]{}[/size]".format("\n".join(lines))
 
     def get_failure_message(self):
         failures = self.app.total_connection_errors
@@ -77,4 +101,8 @@ class DebugCharacter(AnchorLayout):
             if failures >= 5:
                 self.app.is_debug_character_visible = True
                 failure_string = "[color=E7040F]{}[/color]".format(failure_string)
+        # Spooled scans, waiting to be uploaded
+        pending = self.app.uploader.pending
+        if pending > 0:
+            failure_string += "\n[color=E7040F]spool {}[/color]".format(pending)
         return failure_string
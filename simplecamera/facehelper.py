@@ -11,5 +11,6 @@ Builder.load_file(get_filename("kv/facehelper.kv"))
 
 class FaceHelper(BoxLayout):
     app = ObjectProperty()
+    camera = ObjectProperty()
     head_radius = NumericProperty(dp(240))
     font_color = ObjectProperty(WASHED_BLUE_95)
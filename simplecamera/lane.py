@@ -0,0 +1,29 @@
+from kivy.lang import Builder
+from kivy.metrics import dp
+from kivy.properties import NumericProperty, ObjectProperty
+from kivy.uix.floatlayout import FloatLayout
+
+from .lib.resources import get_filename
+
+Builder.load_file(get_filename("kv/lane.kv"))
+
+
+class Lane(FloatLayout):
+    """One camera preview, with its own card, for one capture device."""
+
+    app = ObjectProperty()
+    lane = NumericProperty(0)
+    debug_character = ObjectProperty()
+
+    def on_size(self, instance, size):
+        self.set_card_pos(size)
+
+    def set_card_pos(self, size):
+        card_width, card_height = self.ids["card"].size
+        # Head
+        head_radius = self.ids["body"].head_radius
+        # With arbitrary adjustments
+        x = self.center_x + int(head_radius / 2) + int(card_width / 2) + dp(12.5)
+        y = self.center_y - int(card_height / 2) - dp(50)
+        self.ids["card"].pos = (x, y)
+        self.ids["card_helper"].pos = (x, y)
@@ -0,0 +1,38 @@
+import cv2
+
+# Binarizations, tried in order, one per frame, when voting
+BINARIZATIONS = ("adaptive_mean", "otsu", "gray")
+# Binarizations, run concurrently on each ROI
+PARALLEL_BINARIZATIONS = ("adaptive_mean", "clahe_otsu", "gray")
+VALID_BINARIZATIONS = frozenset(BINARIZATIONS + PARALLEL_BINARIZATIONS)
+
+
+def binarize(name, gray, dst):
+    """
+    Binarize a grayscale ROI, for zbar. The result is always written to dst,
+    so that zbar gets a C-contiguous buffer, even from a cropped ROI.
+
+    adaptive_mean handles uneven lighting, otsu handles low contrast, and gray
+    leaves binarization to zbar, which handles glare better than either.
+    clahe_otsu equalizes contrast locally first, for glare and low contrast.
+
+    :param name: One of VALID_BINARIZATIONS
+    :param gray: Grayscale ROI
+    :param dst: Buffer, of the same shape as gray
+    """
+    if name == "adaptive_mean":
+        cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 11, 2, dst
+        )
+    elif name == "otsu":
+        cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=dst)
+    elif name == "clahe_otsu":
+        # Not shared, CLAHE objects aren't thread safe
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        clahe.apply(gray, dst=dst)
+        cv2.threshold(dst, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=dst)
+    elif name == "gray":
+        dst[...] = gray
+    else:
+        raise ValueError("Unknown binarization: {}".format(name))
+    return dst
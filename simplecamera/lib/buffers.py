@@ -0,0 +1,33 @@
+import threading
+
+import numpy as np
+
+
+class BufferPool(object):
+    """
+    Preallocated working buffers, so that steady state scanning doesn't
+    allocate per frame. Pass them to OpenCV with dst.
+
+    Buffers are per thread, as card areas are scanned concurrently. Each name
+    keeps one buffer, which grows to the largest shape requested, so that
+    tracked windows of varying size reuse it.
+
+    >>> pool = BufferPool()
+    >>> gray = pool.get("gray", (720, 425))
+    >>> gray.shape
+    (720, 425)
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self, name, shape, dtype=np.uint8):
+        """Returns a contiguous view, with undefined contents."""
+        buffers = self.local.__dict__.setdefault("buffers", {})
+        size = int(np.prod(shape))
+        key = (name, np.dtype(dtype))
+        buffer = buffers.get(key)
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, dtype=dtype)
+            buffers[key] = buffer
+        return buffer[:size].reshape(shape)
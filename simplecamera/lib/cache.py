@@ -0,0 +1,71 @@
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class TTLCache(object):
+    """
+    Bounded LRU cache, whose entries expire after ttl seconds.
+
+    >>> cache = TTLCache(maxsize=2, ttl=60)
+    >>> cache.set("12345678", {"line_1": "...", "line_2": "..."})
+    >>> cache.get("12345678")
+    {'line_1': '...', 'line_2': '...'}
+
+    :param maxsize: Entries, least recently used are evicted first
+    :param ttl: Seconds
+    """
+
+    def __init__(self, maxsize=1024, ttl=6 * 60 * 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns the value, or None if missing or expired."""
+        with self.lock:
+            if key in self.entries:
+                expires, value = self.entries[key]
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def get_max_age(headers):
+    """Returns seconds from Cache-Control, 0 if the response mustn't be cached,
+    or None if there is no directive."""
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    match = MAX_AGE.search(cache_control)
+    if match:
+        return int(match.group(1))
@@ -0,0 +1,155 @@
+import logging
+from threading import Event, Lock, Thread
+
+import cv2
+
+from .metrics import stage_metrics
+
+logger = logging.getLogger(__name__)
+
+
+def decode_fourcc(value):
+    value = int(value)
+    return "".join(chr((value >> 8 * i) & 0xFF) for i in range(4))
+
+
+class FrameGrabber(Thread):
+    """
+    Owns a cv2.VideoCapture, and grabs frames on its own thread, so that
+    blocking driver reads never stall the Kivy main thread.
+
+    Only the newest frame is kept. Older frames are dropped, and the sequence
+    number tells readers whether the frame is new.
+
+    MJPG is usually required for HD at 30 fps over USB 2.0. With is_raw_yuv,
+    YUYV frames are requested without conversion, and the Y plane is kept as
+    the grayscale frame, so the scanner needn't convert BGR to grayscale.
+    What the driver actually negotiated is in negotiated.
+
+    >>> grabber = FrameGrabber(0, (1280, 720), 30, fourcc="MJPG")
+    >>> grabber.start()
+    >>> sequence, frame = grabber.read()
+    >>> grabber.release()
+
+    :param fourcc: Requested pixel format, such as "MJPG"
+    :param buffer_size: Driver buffer size, in frames
+    :param is_raw_yuv: Request YUYV, and keep the Y plane
+    """
+
+    def __init__(
+        self, device, resolution, fps, fourcc=None, buffer_size=None, is_raw_yuv=False
+    ):
+        super(FrameGrabber, self).__init__(daemon=True)
+        width, height = resolution
+        self.device = device
+        self.capture = cv2.VideoCapture(device)
+        if is_raw_yuv:
+            fourcc = "YUYV"
+        # Pixel format first, as some drivers reset the resolution
+        if fourcc:
+            self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.capture.set(cv2.CAP_PROP_FPS, fps)
+        if buffer_size:
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+        # Not every backend can skip conversion
+        self.is_raw_yuv = is_raw_yuv and self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        self.negotiated = self.get_negotiated()
+        logger.info("Capture {}: {}".format(device, self.negotiated))
+        # Latest frame slot
+        self.lock = Lock()
+        self.frame = None
+        self.gray = None
+        self.sequence = 0
+        self.dropped_frames = 0
+        self.last_read_sequence = 0
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            with stage_metrics.time("capture"):
+                # A failed frame is a black frame, rather than a frozen preview
+                try:
+                    ret, frame, gray = self.grab_frame()
+                except Exception:
+                    logger.exception("Capture {} failed".format(self.device))
+                    ret, frame, gray = False, None, None
+            if not ret:
+                frame = None
+                # Don't spin, if the device is gone
+                self.stopped.wait(0.1)
+            with self.lock:
+                # Was the previous frame never read?
+                if self.sequence > self.last_read_sequence:
+                    self.dropped_frames += 1
+                self.frame = frame
+                self.gray = gray
+                self.sequence += 1
+
+    def grab_frame(self):
+        """Returns ret, frame, and gray."""
+        # Grab, then retrieve, so that the driver buffer is always drained
+        if not self.capture.grab():
+            return False, None, None
+        ret, frame = self.capture.retrieve()
+        gray = None
+        if ret and self.is_raw_yuv:
+            frame, gray = self.convert_yuv(frame)
+            ret = frame is not None
+        return ret, frame, gray
+
+    def convert_yuv(self, yuyv):
+        """Returns BGR, for preview and upload, and the Y plane. If the frame
+        isn't YUYV at the negotiated resolution, raw YUV is turned off."""
+        width, height = self.negotiated["resolution"]
+        # Some backends accept CONVERT_RGB, but convert anyway
+        if yuyv.ndim == 3 and yuyv.shape[-1] == 3:
+            self.disable_raw_yuv("frames are BGR")
+            return yuyv, None
+        if yuyv.size != width * height * 2:
+            self.disable_raw_yuv("{} bytes per frame".format(yuyv.size))
+            return None, None
+        # Some backends return a flat buffer
+        yuyv = yuyv.reshape(height, width, 2)
+        gray = cv2.extractChannel(yuyv, 0)
+        frame = cv2.cvtColor(yuyv, cv2.COLOR_YUV2BGR_YUYV)
+        return frame, gray
+
+    def disable_raw_yuv(self, reason):
+        logger.warning("Capture {}, not raw YUYV: {}".format(self.device, reason))
+        self.is_raw_yuv = False
+        self.negotiated["is_raw_yuv"] = False
+        # BGR, from the next frame
+        self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+
+    def get_negotiated(self):
+        width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return {
+            "resolution": (width, height),
+            "fps": self.capture.get(cv2.CAP_PROP_FPS),
+            "fourcc": decode_fourcc(self.capture.get(cv2.CAP_PROP_FOURCC)),
+            "buffer_size": int(self.capture.get(cv2.CAP_PROP_BUFFERSIZE)),
+            "is_raw_yuv": self.is_raw_yuv,
+        }
+
+    def read(self):
+        """Returns the sequence number, and the newest frame, without blocking.
+        Frame is None, if the last grab failed."""
+        with self.lock:
+            self.last_read_sequence = self.sequence
+            return self.sequence, self.frame
+
+    def read_planes(self):
+        """Returns the sequence number, the newest frame, and its grayscale
+        Y plane, or None if not capturing raw YUV."""
+        with self.lock:
+            self.last_read_sequence = self.sequence
+            return self.sequence, self.frame, self.gray
+
+    def release(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join(timeout=1)
+        self.capture.release()
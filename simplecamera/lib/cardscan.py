@@ -1,55 +1,330 @@
-from io import BytesIO
-from threading import Thread
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from uuid import uuid4
 
 import cv2
 import requests
-from PIL import Image
+
+from .httpclient import http_client
+from .metrics import stage_metrics
+
+logger = logging.getLogger(__name__)
 
 HALF_HD = (640, 360)
 
+# When the submission queue is full
+OVERFLOW_SPOOL = "spool"
+OVERFLOW_REJECT = "reject"
+
+# Same on every attempt, so that the server can drop duplicates
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# The scan wasn't saved, so it is safe to retry
+UNSAVED_STATUSES = (401, 403, 503)
+
+
+def get_frame_data(frame, width=HALF_HD[0], quality=75, max_area=None):
+    """Returns JPEG bytes, encoded directly from BGR.
+
+    :param width: Downscaled to this width, keeping the aspect ratio
+    :param quality: JPEG quality, 0 to 100
+    :param max_area: Pixels, further downscaled to fit, keeping the aspect ratio
+    """
+    height, frame_width = frame.shape[:2]
+    scale = 1.0
+    if width and frame_width > width:
+        scale = width / frame_width
+    if max_area and frame_width * height * scale * scale > max_area:
+        scale = (max_area / (frame_width * height)) ** 0.5
+    # Reduce size, area interpolation is best for downscaling
+    if scale < 1:
+        size = (
+            max(int(round(frame_width * scale)), 1),
+            max(int(round(height * scale)), 1),
+        )
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    ret, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ret:
+        raise ValueError("JPEG encoding failed")
+    return buf.tobytes()
+
+
+def format_timestamp(timestamp):
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class CardScanUploader(Thread):
+    """
+    One long-lived thread, which spools card scans to disk, then drains the
+    spool with bounded concurrency. Scans that fail with a network or server
+    error are retried with exponential backoff, including after a restart.
+
+    When the server falls behind, up to batch_size scans are uploaded per
+    pass, oldest first.
+
+    Frames are encoded with encode, which may be called before the scan is
+    submitted, so that encoding overlaps other requests.
+
+    Submitted scans wait in a queue of max_pending, until the uploader thread
+    spools them. If it is full, OVERFLOW_SPOOL spools on an overflow thread
+    instead, so no scan is lost, and the caller never waits for encoding, or
+    SQLite. OVERFLOW_REJECT raises queue.Full.
+
+    Scans are uploaded to the URL, with the headers, from set_request, so
+    that spooled scans use the current domain, and token. Until it is called,
+    scans are only spooled. Authentication errors are retried, as the token
+    may be fixed in settings.
+
+    Each upload has the scan's key, in an Idempotency-Key header. Failures
+    where the scan wasn't saved, connection errors, 503, 401, and 403, are
+    retried with exponential backoff. Failures where it may have been saved,
+    read timeouts, and other 5xx, are retried after max_retry_interval, and
+    rely on the server dropping duplicates by key.
+
+    stop spools every submitted scan, and closes the spool, so it must be
+    called once, when the uploader is no longer used.
+
+    Callbacks are called once, on the uploader threads, with (key, data).
+    data is the server response, or {"network_error": True} once a spooled
+    scan has failed notify_after times, or {"upload_error": status_code} if
+    the server rejected it, while it stays spooled, or {"scan_error": True} if
+    the scan couldn't be encoded, or spooled, and was dropped.
+
+    :param spool: A CardScanSpool
+    :param max_workers: Concurrent uploads
+    :param batch_size: Scans per pass
+    :param timeout: Seconds, or (connect, read) seconds, per upload
+    :param max_pending: Submitted scans, not yet spooled
+    :param overflow: OVERFLOW_SPOOL, or OVERFLOW_REJECT
+    """
+
+    def __init__(
+        self,
+        spool,
+        max_workers=2,
+        batch_size=8,
+        timeout=(3.05, 10),
+        retry_interval=0.25,
+        max_retry_interval=60,
+        notify_after=1,
+        max_pending=16,
+        overflow=OVERFLOW_SPOOL,
+    ):
+        super(CardScanUploader, self).__init__(daemon=True)
+        self.spool = spool
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.encode_executor = ThreadPoolExecutor(max_workers=1)
+        # Scans, when the queue is full
+        self.overflow_executor = ThreadPoolExecutor(max_workers=1)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.notify_after = notify_after
+        self.overflow = overflow
+        # Scans, before they are spooled
+        self.incoming = Queue(maxsize=max_pending)
+        self.overflowed_scans = 0
+        self.callbacks = {}
+        # URL, and headers, replaced as a whole from the main thread
+        self.request = None
+        self.pending = spool.count()
+        self.wakeup = Event()
+        self.stopped = Event()
+
+    def encode(self, frame, width=HALF_HD[0], quality=75, max_area=None):
+        """Returns a Future, of JPEG bytes."""
+        return self.encode_executor.submit(
+            self.get_frame_data, frame, width, quality, max_area
+        )
+
+    def get_frame_data(self, frame, width, quality, max_area):
+        with stage_metrics.time("encode"):
+            return get_frame_data(
+                frame, width=width, quality=quality, max_area=max_area
+            )
+
+    def set_request(self, url, headers):
+        """Current URL, and headers, such as the token."""
+        self.request = (url, headers)
+        self.wakeup.set()
 
-class CardScanRequest(Thread):
-    def __init__(self, widget, url, headers, qrcode, timestamp, frame):
-        super(CardScanRequest, self).__init__()
-        self.widget = widget
-        self.url = url
-        self.headers = headers
-        self.qrcode = qrcode
-        self.timestamp = timestamp
-        self.frame = frame
-
-    def get_frame_data(self):
-        # Reduce size
-        frame = cv2.resize(self.frame, HALF_HD, interpolation=cv2.INTER_CUBIC)
-        # Convert to RGB
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        # Convert to PIL
-        image = Image.fromarray(rgb)
-        inmemory_file = BytesIO()
-        image.save(inmemory_file, format="JPEG")
-        data = inmemory_file.getvalue()
-        inmemory_file.close()
-        return data
-
-    def format_timestamp(self):
-        return self.timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    def submit(self, qrcode, timestamp, face_recognition, jpg, callback=None):
+        """Returns a key, which identifies the scan in callbacks.
+
+        :param jpg: A Future, from encode
+        """
+        key = uuid4().hex
+        data = {
+            "qrcode": qrcode,
+            "timestamp": format_timestamp(timestamp),
+            "face_recognition": face_recognition,
+        }
+        scan = (key, data, jpg)
+        # Before the scan is queued, as it may be uploaded immediately
+        if callback is not None:
+            self.callbacks[key] = callback
+        try:
+            self.incoming.put_nowait(scan)
+        except Full:
+            self.overflowed_scans += 1
+            if self.overflow == OVERFLOW_REJECT:
+                self.callbacks.pop(key, None)
+                raise
+            logger.warning("Upload queue full, spooling on the overflow thread")
+            self.overflow_executor.submit(self.spool_overflow, *scan)
+        self.wakeup.set()
+        return key
 
     def run(self):
-        data = {}
+        uploads = []
+        while not self.stopped.is_set():
+            self.spool_incoming()
+            # The only uploader thread, so it must survive a failing spool
+            try:
+                uploads = self.upload_due(uploads)
+            except Exception:
+                logger.exception("Spooled scans not uploaded")
+            # Woken by submit, and by finished uploads
+            self.wakeup.wait(self.retry_interval)
+            self.wakeup.clear()
+
+    def upload_due(self, uploads):
+        # Next batch, once the last one is done
+        uploads = [future for future in uploads if not future.done()]
+        if not uploads and self.request is not None:
+            scans = self.spool.get_due(self.batch_size)
+            uploads = [self.executor.submit(self.upload, scan) for scan in scans]
+            self.pending = self.spool.count()
+        return uploads
+
+    def spool_incoming(self):
+        while True:
+            try:
+                scan = self.incoming.get(False)
+            except Empty:
+                break
+            else:
+                self.spool_scan(*scan)
+
+    def spool_scan(self, key, data, jpg):
         try:
-            response = requests.post(
-                self.url,
-                headers=self.headers,
-                data={
-                    "qrcode": self.qrcode,
-                    "timestamp": self.format_timestamp(),
-                    "face_recognition": self.widget.app.is_face_recognition_active,
-                },
-                files={"jpg": self.get_frame_data()},
-            )
-        except requests.ConnectionError:
-            data["network_error"] = True
+            # Usually already encoded
+            self.spool.add(key, data, jpg.result())
+        except Exception:
+            # Only this scan is dropped, such as if encoding failed, or the disk
+            # is full
+            logger.exception("Scan not spooled")
+            self.notify(key, {"scan_error": True})
+
+    def spool_overflow(self, key, data, jpg):
+        self.spool_scan(key, data, jpg)
+        self.wakeup.set()
+
+    def upload(self, scan):
+        if self.stopped.is_set():
+            # Still spooled, uploaded on the next start
+            return
+        try:
+            self.upload_scan(scan)
+        except Exception:
+            logger.exception("Upload failed")
+            # Not immediately due, so that one bad scan doesn't block the spool
+            try:
+                self.spool.defer(scan["key"], self.max_retry_interval)
+            except Exception:
+                logger.exception("Upload not deferred")
+        finally:
+            self.wakeup.set()
+
+    def upload_scan(self, scan):
+        key = scan["key"]
+        url, headers = self.request
+        headers = dict(headers)
+        headers[IDEMPOTENCY_HEADER] = key
+        try:
+            with stage_metrics.time("upload"):
+                response = http_client.post(
+                    url,
+                    headers=headers,
+                    data=scan["data"],
+                    files={"jpg": scan["jpg"]},
+                    timeout=self.timeout,
+                    # Retried here, with backoff, so the UI is notified sooner
+                    retries=0,
+                )
+        except requests.ConnectionError as e:
+            # Never reached the server
+            self.retry(scan, e)
+        except requests.RequestException as e:
+            # Such as a read timeout, the server may have saved it
+            self.retry(scan, e, may_be_saved=True)
+        else:
+            status_code = response.status_code
+            if status_code in UNSAVED_STATUSES:
+                self.retry(scan, "HTTP {}".format(status_code))
+            elif status_code >= 500:
+                self.retry(scan, "HTTP {}".format(status_code), may_be_saved=True)
+            elif status_code >= 400:
+                self.rejected(scan, response)
+            else:
+                self.uploaded(scan, response)
+
+    def retry(self, scan, error, may_be_saved=False):
+        attempts = scan["attempts"] + 1
+        if may_be_saved:
+            # Rarely, as each retry may be a duplicate, if not dropped by key
+            delay = self.max_retry_interval
         else:
+            delay = min(
+                self.retry_interval * 2 ** scan["attempts"], self.max_retry_interval
+            )
+        logger.warning("Upload failed, attempt {}: {}".format(attempts, error))
+        self.spool.defer(scan["key"], delay)
+        if attempts == self.notify_after:
+            self.notify(scan["key"], {"network_error": True})
+
+    def rejected(self, scan, response):
+        """Kept spooled, rarely retried, in case the server is fixed."""
+        logger.error(
+            "Upload rejected, HTTP {}: {}".format(
+                response.status_code, response.text[:200]
+            )
+        )
+        self.spool.defer(scan["key"], self.max_retry_interval)
+        self.notify(scan["key"], {"upload_error": response.status_code})
+
+    def uploaded(self, scan, response):
+        key = scan["key"]
+        try:
             data = response.json()
-        finally:
-            self.widget.cardscan_queue.put(data, self.widget.cardscan_response)
+        except ValueError:
+            data = {}
+        self.spool.remove(key)
+        # Bandwidth, on metered lines
+        stage_metrics.increment("upload_bytes", len(scan["jpg"]))
+        self.notify(key, data)
+
+    def notify(self, key, data):
+        # Once, so that callbacks don't pile up while offline
+        callback = self.callbacks.pop(key, None)
+        if callback is not None:
+            try:
+                callback(key, data)
+            except Exception:
+                logger.exception("Upload callback failed")
+
+    def stop(self):
+        """Spools submitted scans, waits for uploads, then closes the spool."""
+        self.stopped.set()
+        self.wakeup.set()
+        if self.is_alive():
+            self.join()
+        self.encode_executor.shutdown(wait=True)
+        self.overflow_executor.shutdown(wait=True)
+        # Left in the queue by the uploader thread
+        self.spool_incoming()
+        # Uploads not yet started return early, the rest finish, or time out
+        self.executor.shutdown(wait=True)
+        self.spool.close()
@@ -0,0 +1,157 @@
+import logging
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Keys are used as filenames
+VALID_KEY = re.compile(r"^[0-9A-Za-z-]+$")
+
+
+def decode_jpg(data):
+    """Returns a BGR array, or None if the data can't be decoded."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+class FacePreviewCache(object):
+    """
+    Face previews by cardscan uuid, in two tiers. Decoded BGR arrays are kept
+    in memory, in a LRU bounded by bytes. Raw JPEGs are kept on disk, and
+    decoded into memory on the first hit after a restart.
+
+    Writes, and eviction, are on one disk thread, so that the main thread
+    never waits for them. The directory is only listed once, at startup, and
+    then the size of the on disk tier is tracked as files are written.
+
+    :param directory: On disk tier
+    :param max_memory_bytes: Decoded arrays, least recently used are evicted
+    :param max_disk_bytes: JPEGs, least recently used are evicted
+    """
+
+    def __init__(
+        self,
+        directory,
+        max_memory_bytes=16 * 1024 * 1024,
+        max_disk_bytes=64 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = Lock()
+        # On disk tier, by key, least recently used first. Disk thread only
+        self.files = OrderedDict()
+        self.disk_bytes = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.executor.submit(self.load)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_filename(self, key):
+        return os.path.join(self.directory, "{}.jpg".format(key))
+
+    def get(self, key):
+        """Returns a BGR array, or None."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return self.entries[key]
+        face_preview = self.read(key)
+        if face_preview is not None:
+            self.disk_hits += 1
+            self.add(key, face_preview)
+        else:
+            self.misses += 1
+        return face_preview
+
+    def set(self, key, data, face_preview):
+        """
+        :param data: JPEG bytes
+        :param face_preview: Decoded BGR array
+        """
+        self.add(key, face_preview)
+        self.executor.submit(self.write, key, data)
+
+    def add(self, key, face_preview):
+        with self.lock:
+            if key in self.entries:
+                self.memory_bytes -= self.entries.pop(key).nbytes
+            self.entries[key] = face_preview
+            self.memory_bytes += face_preview.nbytes
+            while self.memory_bytes > self.max_memory_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.memory_bytes -= evicted.nbytes
+
+    def read(self, key):
+        if not VALID_KEY.match(key):
+            return None
+        try:
+            with open(self.get_filename(key), "rb") as jpg_file:
+                data = jpg_file.read()
+        except OSError:
+            return None
+        # Most recently used, for eviction
+        self.executor.submit(self.touch, key)
+        return decode_jpg(data)
+
+    def load(self):
+        """Indexes the on disk tier, least recently used first."""
+        try:
+            files = [f for f in os.scandir(self.directory) if f.name.endswith(".jpg")]
+            files.sort(key=lambda f: f.stat().st_mtime)
+            for f in files:
+                self.files[f.name[: -len(".jpg")]] = f.stat().st_size
+        except OSError:
+            logger.exception("Face previews not indexed")
+        self.disk_bytes = sum(self.files.values())
+        self.evict()
+
+    def touch(self, key):
+        try:
+            # Order is kept by mtime, across restarts
+            os.utime(self.get_filename(key))
+        except OSError:
+            pass
+        if key in self.files:
+            self.files.move_to_end(key)
+
+    def write(self, key, data):
+        if not VALID_KEY.match(key):
+            return
+        filename = self.get_filename(key)
+        tmp_filename = filename + ".tmp"
+        try:
+            # Atomic, so a crash never leaves a partial JPEG
+            with open(tmp_filename, "wb") as jpg_file:
+                jpg_file.write(data)
+            os.replace(tmp_filename, filename)
+        except OSError:
+            logger.exception("Face preview not cached")
+        else:
+            self.disk_bytes -= self.files.pop(key, 0)
+            self.files[key] = len(data)
+            self.disk_bytes += len(data)
+            self.evict()
+
+    def evict(self):
+        while self.disk_bytes > self.max_disk_bytes and self.files:
+            key, size = self.files.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self.get_filename(key))
+            except OSError:
+                logger.exception("Face preview not evicted")
+
+    def close(self):
+        """Waits for pending writes."""
+        self.executor.shutdown(wait=True)
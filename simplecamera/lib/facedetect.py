@@ -0,0 +1,130 @@
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from .buffers import BufferPool
+from .resources import get_filename
+
+logger = logging.getLogger(__name__)
+
+HAAR_CASCADE = "assets/haarcascade_frontalface_default.xml"
+# OpenCV's ResNet-10 SSD face detector
+# https://github.com/opencv/opencv/tree/master/samples/dnn/face_detector
+DNN_CONFIG = "assets/deploy.prototxt"
+DNN_MODEL = "assets/res10_300x300_ssd_iter_140000.caffemodel"
+
+
+class FaceDetector(object):
+    """
+    Face detector interface.
+
+    detect accepts a BGR or grayscale image, and returns a list of
+    (x, y, w, h) rects, in image coordinates.
+    """
+
+    name = None
+    # Grayscale is as good as BGR
+    accepts_gray = False
+
+    def detect(self, image, min_size):
+        raise NotImplementedError
+
+    def warmup(self, image):
+        """Initialize the OpenCL runtime, or any lazy allocations."""
+        self.detect(image, (1, 1))
+
+
+class HaarFaceDetector(FaceDetector):
+    name = "haar"
+    accepts_gray = True
+
+    def __init__(self, scale_factor=1.1, min_neighbors=4):
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        # CLAHE (Contrast Limited Adaptive Histogram Equalization)
+        self.clahe = cv2.createCLAHE(clipLimit=4.0, tileGridSize=(8, 8))
+        # OpenCV Haar cascades
+        self.face_cascade = cv2.CascadeClassifier(get_filename(HAAR_CASCADE))
+        self.pool = BufferPool()
+
+    def detect(self, image, min_size):
+        shape = image.shape[:2]
+        # Convert to grayscale
+        if image.ndim == 3:
+            gray = self.pool.get("gray", shape)
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+        else:
+            gray = image
+        # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
+        cl1 = self.pool.get("clahe", shape)
+        self.clahe.apply(gray, cl1)
+        faces = self.face_cascade.detectMultiScale(
+            cl1,
+            scaleFactor=self.scale_factor,
+            minNeighbors=self.min_neighbors,
+            minSize=min_size,
+        )
+        return [tuple(face) for face in faces]
+
+    def warmup(self, image):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        self.face_cascade.detectMultiScale(image)
+
+
+class DNNFaceDetector(FaceDetector):
+    """
+    SSD face detector, with the cv2.dnn CPU backend. Model files are not
+    distributed with the app, and must be copied to assets.
+    """
+
+    name = "dnn"
+
+    def __init__(self, confidence=0.5, input_size=(300, 300)):
+        self.confidence = confidence
+        self.input_size = input_size
+        self.net = cv2.dnn.readNetFromCaffe(
+            get_filename(DNN_CONFIG), get_filename(DNN_MODEL)
+        )
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    @classmethod
+    def is_available(cls):
+        return all(
+            os.path.exists(get_filename(path)) for path in (DNN_CONFIG, DNN_MODEL)
+        )
+
+    def detect(self, image, min_size):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        height, width = image.shape[:2]
+        # Mean values, from training
+        blob = cv2.dnn.blobFromImage(
+            image, 1.0, self.input_size, (104.0, 177.0, 123.0), swapRB=False
+        )
+        self.net.setInput(blob)
+        detections = self.net.forward()
+        faces = []
+        for detection in detections[0, 0]:
+            confidence = detection[2]
+            if confidence >= self.confidence:
+                box = detection[3:7] * np.array([width, height, width, height])
+                x1, y1, x2, y2 = box.astype(int)
+                x1, y1 = max(x1, 0), max(y1, 0)
+                x2, y2 = min(x2, width), min(y2, height)
+                w, h = x2 - x1, y2 - y1
+                if w >= min_size[0] and h >= min_size[1]:
+                    faces.append((x1, y1, w, h))
+        return faces
+
+
+def get_face_detector(name, scale_factor=1.1):
+    """Returns the named detector, or the Haar cascade if unavailable."""
+    if name == DNNFaceDetector.name:
+        if DNNFaceDetector.is_available():
+            return DNNFaceDetector()
+        logger.warning("DNN face detector model not found, using Haar cascade")
+    return HaarFaceDetector(scale_factor=scale_factor)
@@ -0,0 +1,131 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# From best quality, to least load
+QUALITY_LEVELS = (
+    {
+        "scan_interval": 1,
+        "is_left_scanning_active": True,
+        "face_interval": 1,
+        "fps": 30,
+    },
+    {
+        "scan_interval": 2,
+        "is_left_scanning_active": True,
+        "face_interval": 1,
+        "fps": 30,
+    },
+    {
+        "scan_interval": 2,
+        "is_left_scanning_active": False,
+        "face_interval": 2,
+        "fps": 30,
+    },
+    {
+        "scan_interval": 3,
+        "is_left_scanning_active": False,
+        "face_interval": 3,
+        "fps": 20,
+    },
+    {
+        "scan_interval": 4,
+        "is_left_scanning_active": False,
+        "face_interval": 4,
+        "fps": 15,
+    },
+)
+
+
+class QualityGovernor(object):
+    """
+    Steps through quality levels, driven by measured load. Each level scans
+    every Nth frame, optionally disables left scanning, detects faces every
+    Nth scan, and lowers the preview fps.
+
+    Load is the system cpu, and the share of frames the scan worker skipped,
+    because it was still busy with an earlier frame, since the last update.
+
+    Steps down after step_down_after consecutive overloaded updates, and back
+    up after step_up_after consecutive updates with headroom.
+
+    :param max_cpu: Overloaded, above this percent
+    :param min_cpu: Headroom, below this percent
+    :param max_skip_ratio: Overloaded, above this share of skipped frames
+    :param min_skip_ratio: Headroom, below this share of skipped frames
+    """
+
+    def __init__(
+        self,
+        levels=QUALITY_LEVELS,
+        max_cpu=85.0,
+        min_cpu=60.0,
+        max_skip_ratio=0.5,
+        min_skip_ratio=0.1,
+        step_down_after=2,
+        step_up_after=5,
+    ):
+        self.levels = levels
+        self.max_cpu = max_cpu
+        self.min_cpu = min_cpu
+        self.max_skip_ratio = max_skip_ratio
+        self.min_skip_ratio = min_skip_ratio
+        self.step_down_after = step_down_after
+        self.step_up_after = step_up_after
+        self.level = 0
+        self.overloaded_updates = 0
+        self.headroom_updates = 0
+        # Worker counters, at the last update
+        self.total_frames = 0
+        self.skipped_frames = 0
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def get_skip_ratio(self, total_frames, skipped_frames):
+        """Share of frames skipped, since the last update."""
+        frames = total_frames - self.total_frames
+        skipped = skipped_frames - self.skipped_frames
+        self.total_frames = total_frames
+        self.skipped_frames = skipped_frames
+        if frames <= 0:
+            return 0.0
+        return skipped / frames
+
+    def update(self, total_frames, skipped_frames, cpu):
+        """Returns True, if the level changed.
+
+        :param total_frames: Frames submitted to the scan worker, in total
+        :param skipped_frames: Frames the scan worker skipped, in total
+        :param cpu: System cpu percent
+        """
+        skip_ratio = self.get_skip_ratio(total_frames, skipped_frames)
+        is_overloaded = skip_ratio > self.max_skip_ratio or cpu > self.max_cpu
+        has_headroom = (
+            self.level > 0 and skip_ratio < self.min_skip_ratio and cpu < self.min_cpu
+        )
+        if is_overloaded:
+            self.overloaded_updates += 1
+            self.headroom_updates = 0
+        elif has_headroom:
+            self.headroom_updates += 1
+            self.overloaded_updates = 0
+        else:
+            self.overloaded_updates = 0
+            self.headroom_updates = 0
+        if self.overloaded_updates >= self.step_down_after:
+            return self.set_level(self.level + 1)
+        if self.headroom_updates >= self.step_up_after:
+            return self.set_level(self.level - 1)
+        return False
+
+    def set_level(self, level):
+        level = max(0, min(level, len(self.levels) - 1))
+        self.overloaded_updates = 0
+        self.headroom_updates = 0
+        if level != self.level:
+            logger.info("Quality level: {} -> {}".format(self.level, level))
+            self.level = level
+            return True
+        return False
@@ -0,0 +1,105 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPClient(object):
+    """
+    One pooled requests.Session per host, so that connections are kept alive,
+    and each request doesn't pay for a TCP and TLS handshake.
+
+    Connection errors are retried with backoff, by urllib3. Read errors and
+    5xx responses are only retried for idempotent methods, so a POST is never
+    sent twice. Interactive requests, which are retried by the caller within a
+    time budget, should pass retries=0, so that each attempt takes at most
+    the timeout.
+
+    >>> response = http_client.request("GET", "https://example.com/")
+    >>> future = http_client.submit("GET", "https://example.com/", retries=0)
+
+    :param timeout: Seconds, or (connect, read) seconds
+    :param retries: Default retries, per request
+    :param backoff_factor: Seconds, doubled per retry
+    :param pool_maxsize: Kept alive connections, per host
+    :param max_workers: Threads, for submit
+    """
+
+    def __init__(
+        self,
+        timeout=(3.05, 10),
+        retries=2,
+        backoff_factor=0.1,
+        pool_maxsize=4,
+        max_workers=4,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_maxsize = pool_maxsize
+        self.sessions = {}
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def get_session(self, url, retries=None):
+        if retries is None:
+            retries = self.retries
+        parts = urlsplit(url)
+        # Retries are per adapter, so per session
+        host = (parts.scheme, parts.netloc, retries)
+        with self.lock:
+            if host not in self.sessions:
+                retry = Retry(
+                    total=retries,
+                    backoff_factor=self.backoff_factor,
+                    status_forcelist=(502, 503, 504),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=retry
+                )
+                session = requests.Session()
+                session.mount("{}://".format(parts.scheme), adapter)
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def request(self, method, url, timeout=None, retries=None, **kwargs):
+        """Blocks, and returns a requests.Response."""
+        session = self.get_session(url, retries=retries)
+        if timeout is None:
+            timeout = self.timeout
+        return session.request(method, url, timeout=timeout, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def submit(self, method, url, **kwargs):
+        """Returns a Future, of a requests.Response."""
+        return self.executor.submit(self.request, method, url, **kwargs)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+
+def get_result(response):
+    """JSON, if the response is JSON, otherwise bytes, like UrlRequest."""
+    content_type = response.headers.get("Content-Type", "")
+    if content_type.startswith("application/json"):
+        try:
+            return response.json()
+        except ValueError:
+            pass
+    return response.content
+
+
+# Shared by the whole app
+http_client = HTTPClient()
@@ -0,0 +1,86 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+import numpy as np
+
+
+class StageMetrics(object):
+    """
+    Rolling per stage timings, in milliseconds. Each stage keeps the last
+    max_samples in a fixed size ring buffer, so memory is bounded. Counters,
+    such as bytes uploaded, are running totals. Thread safe.
+
+    >>> stage_metrics = StageMetrics()
+    >>> with stage_metrics.time("zbar"):
+    ...     pass
+    >>> p50, p95 = stage_metrics.get_percentiles("zbar")
+
+    :param max_samples: Ring buffer size, per stage
+    """
+
+    def __init__(self, max_samples=300):
+        self.max_samples = max_samples
+        self.lock = Lock()
+        self.samples = {}
+        self.counts = {}
+        self.totals = {}
+
+    @contextmanager
+    def time(self, stage):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - start_time) * 1000)
+
+    def add(self, stage, milliseconds):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = np.full(self.max_samples, np.nan)
+                self.counts[stage] = 0
+            index = self.counts[stage] % self.max_samples
+            self.samples[stage][index] = milliseconds
+            self.counts[stage] += 1
+
+    def increment(self, counter, value=1):
+        with self.lock:
+            self.totals[counter] = self.totals.get(counter, 0) + value
+
+    def get_totals(self):
+        with self.lock:
+            return dict(self.totals)
+
+    def get_percentiles(self, stage, percentiles=(50, 95)):
+        with self.lock:
+            if stage in self.samples:
+                samples = self.samples[stage].copy()
+            else:
+                return tuple(None for p in percentiles)
+        return tuple(float(value) for value in np.nanpercentile(samples, percentiles))
+
+    def get_summary(self):
+        """Returns {stage: {"p50": ms, "p95": ms, "count": n}}"""
+        summary = {}
+        for stage in list(self.samples):
+            p50, p95 = self.get_percentiles(stage)
+            summary[stage] = {"p50": p50, "p95": p95, "count": self.counts[stage]}
+        return summary
+
+    def flush(self, path, max_size=1024 * 1024):
+        """Appends a JSON line, rotating the file once larger than max_size."""
+        if os.path.exists(path) and os.path.getsize(path) > max_size:
+            os.replace(path, path + ".1")
+        line = {
+            "timestamp": time.time(),
+            "stages": self.get_summary(),
+            "totals": self.get_totals(),
+        }
+        with open(path, "a") as metrics_file:
+            metrics_file.write(json.dumps(line) + "\n")
+
+
+# Shared, by the scanner, capture, and preview
+stage_metrics = StageMetrics()
@@ -0,0 +1,71 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class ChangeDetector(object):
+    """
+    Cheap change detection, by differencing a downsampled grayscale segment
+    against a running background.
+
+    After a change, the segment is reported as changed for hold_time seconds,
+    so that a card held still in front of the camera is still scanned.
+
+    :param scale: Downsampling factor
+    :param alpha: Running background weight
+    :param threshold: Per pixel difference, which counts as changed
+    :param min_changed: Fraction of changed pixels, which counts as motion
+    :param hold_time: Seconds
+    """
+
+    def __init__(
+        self, scale=0.125, alpha=0.05, threshold=25, min_changed=0.01, hold_time=1.0
+    ):
+        self.scale = scale
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.hold_time = hold_time
+        self.background = None
+        self.changed_at = None
+        self.total_frames = 0
+        self.gated_frames = 0
+
+    def has_changed(self, segment):
+        self.total_frames += 1
+        height, width = segment.shape[:2]
+        size = (max(int(width * self.scale), 1), max(int(height * self.scale), 1))
+        is_new = self.background is None or self.background.shape != size[::-1]
+        if is_new:
+            # Working buffers, allocated once
+            self.small = np.empty((size[1], size[0], 3), np.uint8)
+            self.gray = np.empty(size[::-1], np.uint8)
+            self.delta = np.empty(size[::-1], np.uint8)
+            self.mask = np.empty(size[::-1], np.uint8)
+        # Grayscale segments, from the Y plane, needn't be converted
+        if segment.ndim == 2:
+            cv2.resize(segment, size, dst=self.gray, interpolation=cv2.INTER_AREA)
+        else:
+            cv2.resize(segment, size, dst=self.small, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        if is_new:
+            self.background = self.gray.astype(np.float32)
+            is_changed = True
+        else:
+            cv2.convertScaleAbs(self.background, dst=self.delta)
+            cv2.absdiff(self.gray, self.delta, dst=self.delta)
+            cv2.threshold(
+                self.delta, self.threshold, 255, cv2.THRESH_BINARY, dst=self.mask
+            )
+            is_changed = cv2.countNonZero(self.mask) >= self.min_changed * self.mask.size
+            cv2.accumulateWeighted(self.gray, self.background, self.alpha)
+        now = time.monotonic()
+        if is_changed:
+            self.changed_at = now
+        elif self.changed_at is not None:
+            # Hold
+            is_changed = (now - self.changed_at) <= self.hold_time
+        if not is_changed:
+            self.gated_frames += 1
+        return is_changed
@@ -0,0 +1,254 @@
+import logging
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing import shared_memory
+from queue import Empty
+from threading import Lock, Thread
+
+import numpy as np
+
+from .kqueue import KivyQueue
+from .metrics import stage_metrics
+
+logger = logging.getLogger(__name__)
+
+HD_SHAPE = (720, 1280, 3)
+
+
+class SharedFrameRing(object):
+    """
+    Preallocated frame buffers in shared memory, so that frames are copied
+    once, rather than pickled. Each slot has a sequence number, so that a
+    reader can tell if the slot was overwritten.
+
+    :param slots: Frame buffers
+    :param shape: Frame shape
+    :param name: Shared memory name, to attach to an existing ring
+    """
+
+    def __init__(self, slots=3, shape=HD_SHAPE, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        frame_size = int(np.prod(self.shape))
+        # Sequence numbers, then frames
+        header_size = 8 * slots
+        size = header_size + frame_size * slots
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.is_owner = name is None
+        self.sequences = np.ndarray((slots,), dtype=np.int64, buffer=self.shm.buf)
+        self.frames = np.ndarray(
+            (slots,) + self.shape,
+            dtype=np.uint8,
+            buffer=self.shm.buf,
+            offset=header_size,
+        )
+        if self.is_owner:
+            self.sequences[:] = -1
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, slot, sequence, frame):
+        np.copyto(self.frames[slot], frame)
+        self.sequences[slot] = sequence
+
+    def read(self, slot, sequence):
+        """Returns the frame, or None if the slot was overwritten."""
+        if self.sequences[slot] != sequence:
+            return None
+        return self.frames[slot]
+
+    def close(self):
+        # Views must be released, before the buffer is closed
+        del self.sequences, self.frames
+        self.shm.close()
+        if self.is_owner:
+            self.shm.unlink()
+
+
+def scan_process(name, slots, shape, face_detector, requests, results):
+    """Child process. Scans frames from the ring, and returns small result
+    records, without the frame."""
+    from .scanner import Scanner
+
+    ring = SharedFrameRing(slots, shape, name=name)
+    scanner = Scanner(face_detector=face_detector)
+    is_warm = False
+    try:
+        while True:
+            request = requests.get()
+            # Sentinel
+            if request is None:
+                break
+            slot, sequence, options = request
+            start_time = time.perf_counter()
+            frame = ring.read(slot, sequence)
+            result = None
+            if frame is not None:
+                scanner.set_resolution((frame.shape[1], frame.shape[0]))
+                scanner.face_working_size = options["face_working_size"]
+                scanner.set_face_detector(
+                    options["face_detector"], scale_factor=options["face_scale_factor"]
+                )
+                try:
+                    # OpenCL runtime, in this process
+                    if not is_warm:
+                        scanner.warmup(frame)
+                        is_warm = True
+                    result = scanner.scan(frame, options)
+                except Exception:
+                    logger.exception("Scan failed")
+            scan_time = (time.perf_counter() - start_time) * 1000
+            results.put((slot, sequence, result, scan_time))
+    finally:
+        scanner.close()
+        ring.close()
+
+
+class ProcessScanWorker(object):
+    """
+    Scans frames in a child process, so that Python overhead in the scanner
+    never holds the GIL of the Kivy process. Same interface as ScanWorker.
+
+    If the child exits, such as when it crashes in native code, it is
+    restarted, at most once per restart_interval. Frames are skipped until it
+    is back.
+
+    Frames are handed off through a SharedFrameRing. Only QR code text,
+    polygon, and face rect come back, and the frame is added back to the
+    result from the parent's reference. Frames from the grabber are never
+    modified, so no copy is kept.
+
+    :param notify_func: Called when a result is added to the queue
+    :param face_detector: Initial face detector, in the child
+    :param slots: Ring slots
+    :param max_in_flight: Frames scanned, or waiting, before frames are skipped
+    :param restart_interval: Seconds, between restarts of a child that exited
+    """
+
+    def __init__(
+        self,
+        notify_func,
+        face_detector="haar",
+        slots=3,
+        max_in_flight=1,
+        shape=HD_SHAPE,
+        restart_interval=5,
+    ):
+        assert max_in_flight < slots
+        self.queue = KivyQueue(notify_func)
+        self.ring = SharedFrameRing(slots, shape)
+        self.max_in_flight = max_in_flight
+        self.face_detector = face_detector
+        self.restart_interval = restart_interval
+        # Spawn, as forking a process with Kivy, and GL threads, isn't safe
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.start_process()
+        self.restarts = 0
+        self.lock = Lock()
+        # Frames in flight, by sequence
+        self.frames = {}
+        self.next_slot = 0
+        self.total_frames = 0
+        self.skipped_frames = 0
+        self.scan_times = deque(maxlen=30)
+        self.is_stopped = False
+        self.receiver = Thread(target=self.receive, daemon=True)
+        self.receiver.start()
+
+    def start_process(self):
+        # Requests left for a child that exited are dropped
+        self.requests = self.context.Queue()
+        self.process = self.context.Process(
+            target=scan_process,
+            args=(
+                self.ring.name,
+                self.ring.slots,
+                self.ring.shape,
+                self.face_detector,
+                self.requests,
+                self.results,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        self.started = time.monotonic()
+
+    def restart_process(self):
+        """Logged once per exit, retried after restart_interval."""
+        if time.monotonic() - self.started < self.restart_interval:
+            return
+        logger.error(
+            "Scan process exited with code {}, restarting".format(
+                self.process.exitcode
+            )
+        )
+        self.restarts += 1
+        with self.lock:
+            # Never returned
+            self.frames.clear()
+        self.start_process()
+
+    def is_busy(self):
+        with self.lock:
+            return len(self.frames) >= self.max_in_flight
+
+    def submit(self, sequence, frame, options, gray=None):
+        """Returns False, if the frame was skipped. gray is unused, only BGR
+        frames are shared with the child."""
+        self.total_frames += 1
+        if not self.process.is_alive():
+            self.restart_process()
+            self.skipped_frames += 1
+            return False
+        if self.is_busy() or frame.shape != self.ring.shape:
+            self.skipped_frames += 1
+            return False
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.ring.slots
+        self.ring.write(slot, sequence, frame)
+        with self.lock:
+            self.frames[sequence] = frame
+        self.requests.put((slot, sequence, options))
+        return True
+
+    def receive(self):
+        while not self.is_stopped:
+            try:
+                slot, sequence, result, scan_time = self.results.get(timeout=0.5)
+            except Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                frame = self.frames.pop(sequence, None)
+            self.scan_times.append(scan_time)
+            stage_metrics.add("scan", scan_time)
+            if result is not None and frame is not None:
+                result["frame"] = frame
+                self.queue.put(result, sequence)
+
+    def warmup(self, frame):
+        """The child initializes the OpenCL runtime, on its first frame."""
+        return True
+
+    def get_scan_time(self, percentile=95):
+        """Returns a recent scan time, in milliseconds, or None."""
+        scan_times = list(self.scan_times)
+        if scan_times:
+            return float(np.percentile(scan_times, percentile))
+
+    def shutdown(self):
+        self.is_stopped = True
+        self.requests.put(None)
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.receiver.join(timeout=1)
+        self.ring.close()
@@ -0,0 +1,73 @@
+import cv2
+
+from .buffers import BufferPool
+
+# Structuring elements, for gradients and blobs
+GRADIENT_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+BLOB_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+
+
+def locate_qrcodes(
+    gray, scale=0.25, pad=0.2, min_size=40, max_candidates=3, pool=None
+):
+    """
+    Coarse QR code localization, by searching for dense gradients on a
+    downscaled grayscale. QR code modules are high contrast edges in both
+    directions, so they survive downscaling as solid blobs.
+
+    Returns up to max_candidates (x, y, w, h) boxes, in gray coordinates,
+    largest first. Boxes are padded, as zbar requires a quiet zone.
+
+    :param gray: Full resolution grayscale
+    :param scale: Downsampling factor
+    :param pad: Padding, as a fraction of box size
+    :param min_size: Minimum QR code size, in full resolution pixels
+    :param max_candidates: Maximum number of boxes
+    :param pool: BufferPool, for working buffers
+    """
+    if pool is None:
+        pool = BufferPool()
+    height, width = gray.shape[:2]
+    size = (max(int(width * scale), 1), max(int(height * scale), 1))
+    small = pool.get("locate_small", (size[1], size[0]))
+    gradient = pool.get("locate_gradient", (size[1], size[0]))
+    mask = pool.get("locate_mask", (size[1], size[0]))
+    cv2.resize(gray, size, dst=small, interpolation=cv2.INTER_AREA)
+    # Gradients, in both directions
+    cv2.morphologyEx(small, cv2.MORPH_GRADIENT, GRADIENT_KERNEL, dst=gradient)
+    flags = cv2.THRESH_BINARY + cv2.THRESH_OTSU
+    cv2.threshold(gradient, 0, 255, flags, dst=mask)
+    # Merge modules into blobs, then remove thin edges
+    cv2.morphologyEx(mask, cv2.MORPH_CLOSE, BLOB_KERNEL, dst=gradient)
+    cv2.morphologyEx(gradient, cv2.MORPH_OPEN, BLOB_KERNEL, dst=mask)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    candidates = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        # Full resolution
+        x, y, w, h = [int(round(value / scale)) for value in (x, y, w, h)]
+        if w < min_size or h < min_size:
+            continue
+        # Roughly square, allowing for perspective
+        aspect_ratio = w / h
+        if not 0.5 <= aspect_ratio <= 2.0:
+            continue
+        # Mostly filled
+        fill_ratio = cv2.contourArea(contour) / (w * h * scale * scale)
+        if fill_ratio < 0.5:
+            continue
+        candidates.append(pad_box((x, y, w, h), pad, width, height))
+    candidates = sorted(candidates, key=lambda box: box[2] * box[3], reverse=True)
+    return candidates[:max_candidates]
+
+
+def pad_box(box, pad, width, height):
+    """Pad box, and clip to width and height."""
+    x, y, w, h = box
+    pad_x = int(w * pad)
+    pad_y = int(h * pad)
+    x1 = max(x - pad_x, 0)
+    y1 = max(y - pad_y, 0)
+    x2 = min(x + w + pad_x, width)
+    y2 = min(y + h + pad_y, height)
+    return x1, y1, x2 - x1, y2 - y1
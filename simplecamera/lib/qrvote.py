@@ -0,0 +1,61 @@
+import time
+from collections import deque
+
+
+class QRCodeVoter(object):
+    """
+    Short horizon accumulator, of QR code candidates from the last frames.
+
+    A clean read, one valid symbol and nothing else, is accepted immediately.
+    Other reads, such as a valid symbol next to an invalid one, are kept as
+    candidates, and accepted once the same data has been read min_votes times,
+    at roughly the same position, within max_age seconds.
+
+    >>> voter = QRCodeVoter()
+    >>> voter.vote("12345678 abcd", polygon, is_clean=True)
+    True
+
+    :param max_candidates: Candidates kept, oldest are dropped
+    :param min_votes: Matching candidates, to accept a read that isn't clean
+    :param max_age: Seconds, older candidates don't count
+    :param max_shift: Pixels, between polygon centers of matching candidates
+    """
+
+    def __init__(self, max_candidates=5, min_votes=2, max_age=1.0, max_shift=50):
+        self.min_votes = min_votes
+        self.max_age = max_age
+        self.max_shift = max_shift
+        self.candidates = deque(maxlen=max_candidates)
+        self.accepted = 0
+        self.rejected = 0
+
+    def reset(self):
+        self.candidates.clear()
+
+    def vote(self, data, polygon, is_clean):
+        """Returns True, if the read is accepted."""
+        now = time.monotonic()
+        center = get_center(polygon)
+        self.candidates.append((now, data, center))
+        if is_clean or self.get_votes(data, center, now) >= self.min_votes:
+            self.accepted += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def get_votes(self, data, center, now):
+        votes = 0
+        for timestamp, candidate_data, candidate_center in self.candidates:
+            if now - timestamp > self.max_age or candidate_data != data:
+                continue
+            shift_x = abs(candidate_center[0] - center[0])
+            shift_y = abs(candidate_center[1] - center[1])
+            if max(shift_x, shift_y) <= self.max_shift:
+                votes += 1
+        return votes
+
+
+def get_center(polygon):
+    xs = [x for x, y in polygon]
+    ys = [y for x, y in polygon]
+    return sum(xs) / len(xs), sum(ys) / len(ys)
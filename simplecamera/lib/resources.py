@@ -2,6 +2,11 @@ import os
 import sys
 from pathlib import Path
 
+from appdirs import user_data_dir
+
+APP_NAME = "JinjukuCamera"
+APP_AUTHOR = "Jinjuku"
+
 
 def get_filename(relative_path):
     """Get absolute path to resource, works for dev and for PyInstaller"""
@@ -13,3 +18,11 @@ def get_filename(relative_path):
     finally:
         path = os.path.join(dirname, relative_path)
     return path
+
+
+def get_data_dir(*paths):
+    """Get app data directory, or a subdirectory of it, creating as necessary."""
+    path = os.path.join(user_data_dir(APP_NAME, APP_AUTHOR), *paths)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
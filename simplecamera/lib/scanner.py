@@ -0,0 +1,492 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Event, Lock
+
+import cv2
+import numpy as np
+
+from ..constants import FULL_HD, HD
+from .binarize import (
+    BINARIZATIONS,
+    PARALLEL_BINARIZATIONS,
+    VALID_BINARIZATIONS,
+    binarize,
+)
+from .buffers import BufferPool
+from .facedetect import get_face_detector
+from .metrics import stage_metrics
+from .motion import ChangeDetector
+from .qrlocate import locate_qrcodes
+from .qrvote import QRCodeVoter
+from .tracker import RegionTracker
+from .zbar import decode
+
+logger = logging.getLogger(__name__)
+
+# Rekognition minimum size * 2(4)
+# https://aws.amazon.com/rekognition/faqs/
+HD_FACE_SIZE = (120, 120)
+FULL_HD_FACE_SIZE = (240, 240)
+# Haar cascade training window
+CASCADE_WINDOW_SIZE = (24, 24)
+
+# Highlight colors, BGR
+WASHED_YELLOW = (235, 252, 255)
+WASHED_RED = (223, 223, 255)
+WASHED_BLUE = (254, 255, 246)
+LIGHT_YELLOW = (169, 241, 251)
+LIGHT_PINK = (215, 163, 255)
+
+
+class Scanner(object):
+    """
+    Finds QR codes, and faces, in frames.
+
+    No Kivy dependencies, so scans can run on worker threads. Results are
+    plain dicts, with positions in frame coordinates.
+    """
+
+    def __init__(self, face_detector="haar"):
+        self.resolution = None
+        # Working buffers, per thread
+        self.pool = BufferPool()
+        # Face area is downsampled to this width, or 0 for full resolution
+        self.face_working_size = 285
+        self.face_detector_name = None
+        self.set_face_detector(face_detector)
+        self.face_detection_time = None
+        # Scans with a QR code, for face detection frequency
+        self.face_scans = 0
+        # One per card area position
+        self.change_detectors = {}
+        self.total_frames = 0
+        self.gated_frames = 0
+        # Last QR code in frame coordinates, and face in face area coordinates
+        self.qrcode_tracker = RegionTracker()
+        self.face_tracker = RegionTracker()
+        # Candidates from the last frames, and the binarization for this frame
+        self.qrcode_voter = QRCodeVoter()
+        self.binarization_index = 0
+        # Binarizations of one ROI, when run concurrently. Created on first use,
+        # and after close, as workers share the scanner
+        self.binarization_executor = None
+        self.binarization_lock = Lock()
+
+    def set_resolution(self, resolution):
+        """Returns True, if the resolution is supported."""
+        if resolution == self.resolution:
+            return True
+        if resolution == HD:
+            self.resolution = resolution
+            self.qrcode_tracker.reset()
+            self.face_tracker.reset()
+            self.qrcode_voter.reset()
+            # Total area is 306000
+            self.card_area = (425, 720)
+            self.card_pad_x = 0
+            self.card_pad_y = 0
+            # Total area is 273600
+            self.face_area = (570, 570)
+            self.face_position = (355, 75)
+            return True
+
+    def get_card_positions(self, is_left_scanning_active):
+        # Right first
+        positions = [(self.card_pad_x, self.card_pad_y)]
+        if is_left_scanning_active:
+            x = self.resolution[0] - self.card_area[0] - self.card_pad_x
+            positions.append((x, self.card_pad_y))
+        return positions
+
+    def has_changed(self, frame, position):
+        if position not in self.change_detectors:
+            self.change_detectors[position] = ChangeDetector()
+        segment = self.get_segment(frame, self.card_area, position)
+        return self.change_detectors[position].has_changed(segment)
+
+    def set_face_detector(self, name, scale_factor=1.1):
+        if name != self.face_detector_name:
+            self.face_detector_name = name
+            self.face_detector = get_face_detector(name, scale_factor=scale_factor)
+        elif hasattr(self.face_detector, "scale_factor"):
+            self.face_detector.scale_factor = scale_factor
+
+    def warmup(self, frame):
+        """Scan a 25x25 sample to initialize the OpenCL runtime."""
+        segment = self.get_segment(frame, (25, 25))
+        self.face_detector.warmup(segment)
+
+    def scan(self, frame, options, executor=None, gray=None):
+        """Search for a QR code, on the right then the left. With an executor,
+        both sides are decoded concurrently. With gray, the Y plane of a raw YUV
+        frame, nothing is converted to grayscale."""
+        result = {"qrcode": None, "polygon": None, "face": None, "is_complete": False}
+        positions = self.get_card_positions(options["is_left_scanning_active"])
+        self.total_frames += 1
+        # QR codes are decoded in grayscale
+        image = gray if gray is not None else frame
+        # Skip card areas, where nothing moved
+        if options["is_motion_gating_active"]:
+            positions = [p for p in positions if self.has_changed(image, p)]
+            if not positions:
+                self.gated_frames += 1
+                return result
+        positions, segments = self.get_qrcode_regions(image, positions)
+        # One binarization per frame when voting, or several concurrently
+        is_voting = options.get("is_qrcode_voting_active", False)
+        binarizations = self.get_binarizations(options)
+        if executor is not None and len(segments) > 1:
+            qrcodes = list(
+                executor.map(
+                    self.get_qrcode, segments, [binarizations] * len(segments)
+                )
+            )
+        else:
+            qrcodes = []
+            for segment in segments:
+                qrcodes.append(self.get_qrcode(segment, binarizations))
+                if qrcodes[-1]:
+                    break
+        for position, qrcode in zip(positions, qrcodes):
+            if qrcode:
+                data, polygon, is_clean = qrcode
+                x, y = position
+                polygon = [(px + x, py + y) for px, py in polygon]
+                if is_voting and not self.qrcode_voter.vote(data, polygon, is_clean):
+                    continue
+                result["qrcode"] = data
+                result["polygon"] = polygon
+                break
+        # Next binarization, only if this one found nothing
+        if is_voting and len(binarizations) == 1 and not any(qrcodes):
+            self.binarization_index += 1
+            self.binarization_index %= len(BINARIZATIONS)
+        if result["qrcode"]:
+            points = np.array(result["polygon"], dtype=np.int32)
+            self.qrcode_tracker.hit(cv2.boundingRect(points))
+        else:
+            self.qrcode_tracker.miss()
+        if result["qrcode"]:
+            self.face_scans += 1
+            # Detect faces every Nth scan, when overloaded
+            is_face_scan = self.face_scans % options.get("face_interval", 1) == 0
+            if options["is_face_detection_active"] and is_face_scan:
+                # Search for face, in grayscale if possible
+                if gray is not None and self.face_detector.accepts_gray:
+                    image = gray
+                else:
+                    image = frame
+                face_segment = self.get_segment(
+                    image, self.face_area, self.face_position
+                )
+                face_pos = self.get_face(face_segment)
+                if face_pos is not None:
+                    result["face"] = self.get_face_rect(
+                        frame,
+                        self.face_position,
+                        face_pos,
+                        options["is_face_recognition_active"],
+                    )
+                    result["is_complete"] = result["face"] is not None
+            elif not options["is_face_detection_active"]:
+                result["is_complete"] = True
+        return result
+
+    def get_binarizations(self, options):
+        if options.get("is_parallel_binarization_active", False):
+            names = options.get("parallel_binarizations", PARALLEL_BINARIZATIONS)
+            binarizations = tuple(b for b in names if b in VALID_BINARIZATIONS)
+            if binarizations:
+                return binarizations
+        if options.get("is_qrcode_voting_active", False):
+            return (BINARIZATIONS[self.binarization_index],)
+        return ("adaptive_mean",)
+
+    def get_qrcode_regions(self, frame, positions):
+        """Returns positions, and segments. A window around the last QR code,
+        if any, otherwise the card areas."""
+        height, width = frame.shape[:2]
+        window = self.qrcode_tracker.get_window(width, height)
+        if window is not None:
+            x, y, w, h = window
+            return [(x, y)], [self.crop_segment(frame, (x, y), (w, h))]
+        segments = [
+            self.get_segment(frame, self.card_area, position) for position in positions
+        ]
+        return positions, segments
+
+    def get_qrcode(self, segment, binarizations=("adaptive_mean",)):
+        """Returns data, polygon in segment coordinates, and whether the read
+        was clean, or None."""
+        if segment.ndim == 2:
+            gray = segment
+        else:
+            # Convert to grayscale, as binarization requires
+            gray = self.pool.get("gray", segment.shape[:2])
+            cv2.cvtColor(segment, cv2.COLOR_BGR2GRAY, dst=gray)
+        # Coarse, candidates from a downscaled grayscale
+        for x, y, w, h in locate_qrcodes(gray, pool=self.pool):
+            roi = self.crop_segment(gray, (x, y), (w, h))
+            qrcode = self.decode_qrcode(roi, binarizations)
+            if qrcode:
+                data, polygon, is_clean = qrcode
+                return data, [(px + x, py + y) for px, py in polygon], is_clean
+        # Fine, fallback to the whole segment
+        return self.decode_qrcode(gray, binarizations)
+
+    def decode_qrcode(self, gray, binarizations=("adaptive_mean",)):
+        # cv2.adaptiveThreshold is hard on CPU, so Otsu, CLAHE, and raw
+        # grayscale, are only tried on other frames when voting, or on other
+        # cores when run concurrently
+        if len(binarizations) == 1:
+            return self.decode_binarized(gray, binarizations[0])
+        return self.decode_concurrently(gray, binarizations)
+
+    def decode_concurrently(self, gray, binarizations):
+        """The first valid QR code wins. Binarizations which haven't started
+        are cancelled, and those which have skip zbar, and are ignored."""
+        executor = self.get_binarization_executor()
+        cancelled = Event()
+        futures = {
+            executor.submit(
+                self.decode_binarized, gray, binarization, cancelled
+            ): binarization
+            for binarization in binarizations
+        }
+        try:
+            for future in as_completed(futures):
+                qrcode = future.result()
+                if qrcode:
+                    binarization = futures[future]
+                    stage_metrics.increment("binarize_{}_wins".format(binarization))
+                    return qrcode
+        finally:
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+
+    def get_binarization_executor(self):
+        # Right and left card areas are decoded concurrently
+        with self.binarization_lock:
+            if self.binarization_executor is None:
+                self.binarization_executor = ThreadPoolExecutor(
+                    max_workers=len(PARALLEL_BINARIZATIONS)
+                )
+            return self.binarization_executor
+
+    def close(self):
+        """Shuts down the binarization threads, if any."""
+        with self.binarization_lock:
+            executor = self.binarization_executor
+            self.binarization_executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def decode_binarized(self, gray, binarization, cancelled=None):
+        """Hit rate, and cost, are counted per binarization, for tuning."""
+        start_time = time.perf_counter()
+        threshold = self.pool.get("threshold", gray.shape)
+        with stage_metrics.time("threshold"):
+            binarize(binarization, gray, threshold)
+        if cancelled is not None and cancelled.is_set():
+            return None
+        with stage_metrics.time("zbar"):
+            qrcodes = self.get_all_qrcodes(threshold)
+        valid_qrcode = self.get_valid_qrcode(qrcodes)
+        milliseconds = (time.perf_counter() - start_time) * 1000
+        stage_metrics.increment("binarize_{}_tries".format(binarization))
+        stage_metrics.increment("binarize_{}_ms".format(binarization), milliseconds)
+        # QR code, clean if it was the only symbol
+        if valid_qrcode:
+            stage_metrics.increment("binarize_{}_hits".format(binarization))
+            polygon = [(point.x, point.y) for point in valid_qrcode.polygon]
+            is_clean = len(qrcodes) == 1
+            return valid_qrcode.data.decode("utf8"), polygon, is_clean
+
+    def get_all_qrcodes(self, threshold):
+        # No tobytes() copy
+        return decode(threshold)
+
+    def get_valid_qrcode(self, qrcodes):
+        """Returns largest QR code"""
+        choices = []
+        for qrcode in qrcodes:
+            if self.is_valid_qrcode(qrcode):
+                x, y, w, h = qrcode.rect
+                size = w * h
+                choices.append({"qrcode": qrcode, "size": size})
+        choices = sorted(choices, key=lambda k: k["size"], reverse=True)
+        for choice in choices:
+            qrcode = choice["qrcode"]
+            return qrcode
+
+    def is_valid_qrcode(self, qrcode):
+        qr = qrcode.data.decode("utf8")
+        try:
+            card_number, password = qr.split(" ")
+            assert len(card_number) == 8
+            int(card_number)
+        except Exception:
+            logger.info("Invalid: {}".format(qrcode.data))
+        else:
+            return True
+
+    def get_face(self, segment):
+        height, width = segment.shape[:2]
+        # Window around the last face, if any
+        window = self.face_tracker.get_window(width, height)
+        if window is not None:
+            x, y, w, h = window
+            faces = self.get_all_faces(self.crop_segment(segment, (x, y), (w, h)))
+            faces = [(fx + x, fy + y, fw, fh) for fx, fy, fw, fh in faces]
+        else:
+            faces = self.get_all_faces(segment)
+        face = self.get_valid_face(faces)
+        if face is not None:
+            self.face_tracker.hit(face)
+        else:
+            self.face_tracker.miss()
+        return face
+
+    def get_face_rect(self, frame, position, face, is_face_recognition_active):
+        """Returns face rect in frame coordinates, or None if out of frame."""
+        x, y, w, h = face
+        # Completely arbitrary
+        if is_face_recognition_active:
+            area = (w, h + 150)
+            pos = (x + position[0], y + position[1] - 75)
+        else:
+            area = (w, h)
+            pos = (x + position[0], y + position[1])
+        height, width = frame.shape[:2]
+        if pos[0] < 0 or pos[1] < 0:
+            return None
+        if pos[0] + area[0] > width or pos[1] + area[1] > height:
+            return None
+        return pos + area
+
+    def get_face_segment(self, frame, position, face, is_face_recognition_active):
+        rect = self.get_face_rect(frame, position, face, is_face_recognition_active)
+        if rect is not None:
+            x, y, w, h = rect
+            return self.crop_segment(frame, (x, y), (w, h))
+
+    def get_all_faces(self, segment):
+        start_time = time.perf_counter()
+        if self.resolution == FULL_HD:
+            min_size = FULL_HD_FACE_SIZE
+        else:
+            min_size = HD_FACE_SIZE
+        # Downsample, faces are much larger than the cascade window
+        scale = self.get_face_scale()
+        if scale < 1:
+            height, width = segment.shape[:2]
+            size = (int(round(width * scale)), int(round(height * scale)))
+            resized = self.pool.get("face", (size[1], size[0]) + segment.shape[2:])
+            cv2.resize(segment, size, dst=resized, interpolation=cv2.INTER_AREA)
+            segment = resized
+            min_size = tuple(
+                max(int(size * scale), window)
+                for size, window in zip(min_size, CASCADE_WINDOW_SIZE)
+            )
+        faces = self.face_detector.detect(segment, min_size)
+        # Segment coordinates
+        faces = [tuple(int(round(value / scale)) for value in face) for face in faces]
+        self.face_detection_time = (time.perf_counter() - start_time) * 1000
+        stage_metrics.add("face", self.face_detection_time)
+        logger.debug("Face detection: {:.1f}ms".format(self.face_detection_time))
+        return faces
+
+    def get_face_scale(self):
+        """Same scale for the face area, and windows within it."""
+        width = self.face_area[0]
+        if self.face_working_size and self.face_working_size < width:
+            return self.face_working_size / width
+        return 1.0
+
+    def get_valid_face(self, faces):
+        """Get largest face, which exceeds minimum size."""
+        choices = []
+        for face in faces:
+            x, y, w, h = face
+            size = w * h
+            if self.resolution == FULL_HD:
+                face_size = FULL_HD_FACE_SIZE
+            else:
+                face_size = HD_FACE_SIZE
+            min_size = face_size[0] * face_size[1]
+            if size >= min_size:
+                choices.append({"face": face, "size": size})
+        if len(choices):
+            choices = sorted(choices, key=lambda k: k["size"], reverse=True)
+            for choice in choices:
+                return choice["face"]
+
+    def get_face_preview(self, frame):
+        # Face preview, square...
+        height = frame.shape[0]
+        return self.get_segment(frame, (height, height))
+
+    def highlight(self, frame, result, is_left_scanning_active):
+        """Highlight scanning areas, and any result, for debugging."""
+        with stage_metrics.time("highlight"):
+            self.highlight_areas(frame, result, is_left_scanning_active)
+
+    def highlight_areas(self, frame, result, is_left_scanning_active):
+        colors = (WASHED_YELLOW, WASHED_RED)
+        positions = self.get_card_positions(is_left_scanning_active)
+        for position, color in zip(positions, colors):
+            segment = self.get_segment(frame, self.card_area, position)
+            self.highlight_segment(segment, color)
+        if result is not None:
+            if result["qrcode"]:
+                segment = self.get_segment(frame, self.face_area, self.face_position)
+                self.highlight_segment(segment, WASHED_BLUE)
+                self.highlight_qrcode_polygon(frame, result)
+            if result["face"] is not None:
+                x, y, w, h = result["face"]
+                segment = self.crop_segment(frame, (x, y), (w, h))
+                self.highlight_segment(segment, LIGHT_PINK, alpha=0.5)
+
+    def highlight_qrcode(self, frame, result):
+        """Highlight the QR code only, for the card preview."""
+        with stage_metrics.time("highlight"):
+            self.highlight_qrcode_polygon(frame, result)
+
+    def highlight_qrcode_polygon(self, frame, result):
+        self.highlight_polygon(frame, result["polygon"], LIGHT_YELLOW, alpha=0.90)
+
+    def highlight_segment(self, segment, color, alpha=0.35):
+        x, y = (0, 0)
+        h, w, _ = segment.shape
+        polygon = [(x, y), (x, y + h), (x + w, y + h), (x + w, y)]
+        self.highlight_polygon(segment, polygon, color, alpha=alpha)
+
+    def highlight_polygon(self, segment, polygon, color, alpha=0.5):
+        overlay = self.pool.get("overlay", segment.shape)
+        np.copyto(overlay, segment)
+        points = np.array(polygon, dtype=np.int32)
+        cv2.fillConvexPoly(overlay, points=points, color=color, lineType=cv2.LINE_AA)
+        cv2.addWeighted(overlay, alpha, segment, 1 - alpha, 0, segment)
+
+    def get_segment(self, frame, area, position=(None, None)):
+        height, width = frame.shape[:2]
+        w, h = area
+        x, y = position
+        if x is None:
+            x = int((width - w) / 2)
+        if y is None:
+            y = int((height - h) / 2)
+        assert (width - (w + x)) >= 0
+        assert (height - (h + y)) >= 0
+        assert (w + x) <= width
+        assert (y + h) <= height
+        position = x, y
+        return self.crop_segment(frame, position, area)
+
+    def crop_segment(self, frame, position, area):
+        x, y = position
+        w, h = area
+        cropped = frame[y : (y + h), x : (x + w)]
+        return cropped
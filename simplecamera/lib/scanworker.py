@@ -0,0 +1,92 @@
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .kqueue import KivyQueue
+from .metrics import stage_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ScanWorker(object):
+    """
+    Scans frames on a thread pool, so that preview rendering never waits for
+    zbar. OpenCV and zbar release the GIL, so threads are enough.
+
+    While a frame is being scanned, new frames are skipped, rather than
+    queued. Results are posted back with a KivyQueue, as
+    (result, sequence) tuples.
+
+    :param scanner: A Scanner
+    :param notify_func: Called when a result is added to the queue
+    :param max_workers: Threads for decoding card areas concurrently
+    """
+
+    def __init__(self, scanner, notify_func, max_workers=2):
+        self.scanner = scanner
+        self.queue = KivyQueue(notify_func)
+        # One frame at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Right and left card areas, concurrently
+        self.decode_executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.future = None
+        self.total_frames = 0
+        self.skipped_frames = 0
+        # Recent scan times, in milliseconds
+        self.scan_times = deque(maxlen=30)
+
+    def is_busy(self):
+        return self.future is not None and not self.future.done()
+
+    def submit(self, sequence, frame, options, gray=None):
+        """Returns False, if the frame was skipped."""
+        self.total_frames += 1
+        if self.is_busy():
+            self.skipped_frames += 1
+            return False
+        self.future = self.executor.submit(self.run, sequence, frame, options, gray)
+        return True
+
+    def warmup(self, frame):
+        """Initializes the OpenCL runtime, on the worker thread. Returns False,
+        if the worker was busy, so that it can be tried again."""
+        if self.is_busy():
+            return False
+        # Frames are skipped until it is done
+        self.future = self.executor.submit(self.run_warmup, frame)
+        return True
+
+    def run_warmup(self, frame):
+        try:
+            self.scanner.warmup(frame)
+        except Exception:
+            logger.exception("Warmup failed")
+
+    def get_scan_time(self, percentile=95):
+        """Returns a recent scan time, in milliseconds, or None."""
+        scan_times = list(self.scan_times)
+        if scan_times:
+            return float(np.percentile(scan_times, percentile))
+
+    def run(self, sequence, frame, options, gray=None):
+        start_time = time.perf_counter()
+        try:
+            result = self.scanner.scan(
+                frame, options, executor=self.decode_executor, gray=gray
+            )
+        except Exception:
+            logger.exception("Scan failed")
+        else:
+            scan_time = (time.perf_counter() - start_time) * 1000
+            self.scan_times.append(scan_time)
+            stage_metrics.add("scan", scan_time)
+            result["frame"] = frame
+            self.queue.put(result, sequence)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        self.decode_executor.shutdown(wait=False)
+        self.scanner.close()
@@ -0,0 +1,111 @@
+import json
+import sqlite3
+import time
+from threading import Lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cardscan (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL,
+    jpg BLOB NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    created REAL NOT NULL
+)
+"""
+
+
+class CardScanSpool(object):
+    """
+    Card scans waiting to be uploaded, in SQLite, so that they survive
+    network dropouts, crashes, and restarts.
+
+    Scans are written before the first upload attempt, and deleted once the
+    server has accepted them. Only the scan is spooled, never the URL or the
+    token, which are current when the scan is uploaded.
+
+    :param path: Database filename
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        # Shared by the uploader threads, so serialized with the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            # Durable, without a full sync per write
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            is_migrated = self.migrate()
+            self.connection.execute(SCHEMA)
+        # Outside a transaction, so that the old token isn't left in free pages
+        if is_migrated:
+            with self.lock:
+                self.connection.execute("VACUUM")
+
+    def migrate(self):
+        """Drops url and headers, with the token, from older spools. Returns
+        True, if the spool was migrated."""
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(cardscan)")
+        ]
+        if "headers" in columns:
+            self.connection.execute("ALTER TABLE cardscan RENAME TO cardscan_old")
+            self.connection.execute(SCHEMA)
+            self.connection.execute(
+                "INSERT INTO cardscan (key, data, jpg, attempts, next_attempt, "
+                "created) SELECT key, data, jpg, attempts, next_attempt, created "
+                "FROM cardscan_old ORDER BY id"
+            )
+            self.connection.execute("DROP TABLE cardscan_old")
+            return True
+
+    def add(self, key, data, jpg):
+        """Spools a scan, which is due immediately."""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO cardscan (key, data, jpg, next_attempt, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(data), jpg, now, now),
+            )
+
+    def get_due(self, limit):
+        """Returns up to limit scans, oldest first, which are due."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, data, jpg, attempts FROM cardscan "
+                "WHERE next_attempt <= ? ORDER BY id LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        return [
+            {
+                "key": key,
+                "data": json.loads(data),
+                "jpg": jpg,
+                "attempts": attempts,
+            }
+            for key, data, jpg, attempts in rows
+        ]
+
+    def remove(self, key):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM cardscan WHERE key = ?", (key,))
+
+    def defer(self, key, delay):
+        """Retries the scan, after delay seconds."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE cardscan SET attempts = attempts + 1, next_attempt = ? "
+                "WHERE key = ?",
+                (time.time() + delay, key),
+            )
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM cardscan").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,122 @@
+import os
+from threading import Event, Thread
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MEGABYTE = 1024 * 1024
+
+
+class SystemMonitor(Thread):
+    """
+    Samples system and process CPU, and process memory, off the Kivy main
+    thread. Reads /proc on Linux, otherwise psutil if installed.
+
+    Values are exponentially smoothed, so that single spikes don't flip
+    scheduling decisions.
+
+    :param interval: Seconds between samples
+    :param alpha: Smoothing weight of the newest sample
+    """
+
+    def __init__(self, interval=0.5, alpha=0.3):
+        super(SystemMonitor, self).__init__(daemon=True)
+        self.interval = interval
+        self.alpha = alpha
+        # Percent of all cores
+        self.cpu = 0.0
+        self.process_cpu = 0.0
+        # Resident set size, in megabytes
+        self.memory = 0.0
+        # Percent used
+        self.system_memory = 0.0
+        self.total_samples = 0
+        self.is_proc = os.path.exists("/proc/self/stat")
+        self.is_available = self.is_proc or psutil is not None
+        self.stopped = Event()
+
+    def run(self):
+        if not self.is_available:
+            return
+        if self.is_proc:
+            previous = self.read_ticks()
+        else:
+            process = psutil.Process()
+            # First call returns 0.0
+            psutil.cpu_percent(None)
+            process.cpu_percent(None)
+        while not self.stopped.wait(self.interval):
+            try:
+                if self.is_proc:
+                    current = self.read_ticks()
+                    cpu, process_cpu = self.get_cpu_from_ticks(previous, current)
+                    previous = current
+                    memory = self.read_rss()
+                    system_memory = self.read_system_memory()
+                else:
+                    cpu = psutil.cpu_percent(None)
+                    process_cpu = process.cpu_percent(None) / psutil.cpu_count()
+                    memory = process.memory_info().rss / MEGABYTE
+                    system_memory = psutil.virtual_memory().percent
+            except (OSError, ValueError):
+                continue
+            self.total_samples += 1
+            self.cpu = self.smooth(self.cpu, cpu)
+            self.process_cpu = self.smooth(self.process_cpu, process_cpu)
+            self.memory = self.smooth(self.memory, memory)
+            self.system_memory = self.smooth(self.system_memory, system_memory)
+
+    def stop(self):
+        self.stopped.set()
+
+    def smooth(self, value, sample):
+        # First sample, nothing to smooth
+        if self.total_samples == 1:
+            return sample
+        return value + self.alpha * (sample - value)
+
+    def read_ticks(self):
+        """Returns total, idle, and process clock ticks."""
+        with open("/proc/stat") as stat_file:
+            # cpu user nice system idle iowait irq softirq steal guest guest_nice
+            fields = [int(field) for field in stat_file.readline().split()[1:]]
+        # Guest time is already included in user time
+        total = sum(fields[:8])
+        idle = sum(fields[3:5])
+        with open("/proc/self/stat") as stat_file:
+            data = stat_file.read()
+        # Process name may contain spaces, so split after it
+        fields = data[data.rindex(")") + 2 :].split()
+        # utime, stime
+        process = int(fields[11]) + int(fields[12])
+        return total, idle, process
+
+    def get_cpu_from_ticks(self, previous, current):
+        total = current[0] - previous[0]
+        if total <= 0:
+            return self.cpu, self.process_cpu
+        idle = current[1] - previous[1]
+        process = current[2] - previous[2]
+        cpu = 100.0 * (total - idle) / total
+        process_cpu = 100.0 * process / total
+        return cpu, process_cpu
+
+    def read_rss(self):
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    # Kilobytes
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    def read_system_memory(self):
+        meminfo = {}
+        with open("/proc/meminfo") as meminfo_file:
+            for line in meminfo_file:
+                key, value = line.split(":", 1)
+                meminfo[key] = int(value.split()[0])
+        total = meminfo["MemTotal"]
+        available = meminfo.get("MemAvailable", meminfo["MemFree"])
+        return 100.0 * (total - available) / total
@@ -0,0 +1,52 @@
+import time
+
+
+class RegionTracker(object):
+    """
+    Remembers the last location of a QR code, or face, so that the next
+    frames search a padded window around it, rather than the whole area.
+
+    After max_misses consecutive misses, or max_age seconds since the last
+    hit, the tracker is reset, and the whole area is searched again.
+
+    :param pad: Padding, as a fraction of the last location's size
+    :param max_misses: Consecutive misses, before the tracker is reset
+    :param max_age: Seconds
+    """
+
+    def __init__(self, pad=0.5, max_misses=5, max_age=2.0):
+        self.pad = pad
+        self.max_misses = max_misses
+        self.max_age = max_age
+        self.reset()
+
+    def reset(self):
+        self.rect = None
+        self.misses = 0
+        self.updated_at = None
+
+    def get_window(self, width, height):
+        """Returns padded (x, y, w, h) clipped to width and height, or None."""
+        if self.rect is not None:
+            if time.monotonic() - self.updated_at > self.max_age:
+                self.reset()
+            else:
+                x, y, w, h = self.rect
+                pad_x = int(w * self.pad)
+                pad_y = int(h * self.pad)
+                x1 = max(x - pad_x, 0)
+                y1 = max(y - pad_y, 0)
+                x2 = min(x + w + pad_x, width)
+                y2 = min(y + h + pad_y, height)
+                return x1, y1, x2 - x1, y2 - y1
+
+    def hit(self, rect):
+        self.rect = tuple(int(value) for value in rect)
+        self.misses = 0
+        self.updated_at = time.monotonic()
+
+    def miss(self):
+        if self.rect is not None:
+            self.misses += 1
+            if self.misses >= self.max_misses:
+                self.reset()
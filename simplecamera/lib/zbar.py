@@ -0,0 +1,49 @@
+from ctypes import c_void_p
+
+from pyzbar.pyzbar import (
+    _FOURCC,
+    _decode_symbols,
+    _image,
+    _image_scanner,
+    _symbols_for_image,
+)
+from pyzbar.pyzbar_error import PyZbarError
+from pyzbar.wrapper import (
+    ZBarConfig,
+    ZBarSymbol,
+    zbar_image_scanner_set_config,
+    zbar_image_set_data,
+    zbar_image_set_format,
+    zbar_image_set_size,
+    zbar_scan_image,
+)
+
+
+def decode(gray, symbols=(ZBarSymbol.QRCODE,)):
+    """
+    Same as pyzbar.pyzbar.decode, but zbar reads the NumPy buffer directly,
+    rather than a tobytes() copy.
+
+    :param gray: C-contiguous, uint8 grayscale
+    :param symbols: Symbol types to decode
+    """
+    assert gray.ndim == 2 and gray.dtype == "uint8"
+    assert gray.flags["C_CONTIGUOUS"]
+    height, width = gray.shape
+    results = []
+    with _image_scanner() as scanner:
+        # Disable all but the symbols of interest
+        for symbol in set(ZBarSymbol).difference(symbols):
+            zbar_image_scanner_set_config(scanner, symbol, ZBarConfig.CFG_ENABLE, 0)
+        for symbol in symbols:
+            zbar_image_scanner_set_config(scanner, symbol, ZBarConfig.CFG_ENABLE, 1)
+        with _image() as image:
+            zbar_image_set_format(image, _FOURCC["L800"])
+            zbar_image_set_size(image, width, height)
+            # gray must outlive zbar_scan_image
+            data = gray.ctypes.data_as(c_void_p)
+            zbar_image_set_data(image, data, gray.nbytes, None)
+            if zbar_scan_image(scanner, image) < 0:
+                raise PyZbarError("Unsupported image format")
+            results.extend(_decode_symbols(_symbols_for_image(image)))
+    return results
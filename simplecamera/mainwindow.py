@@ -1,10 +1,11 @@
 from kivy.core.window import Window
 from kivy.lang import Builder
-from kivy.metrics import dp
 from kivy.properties import ObjectProperty
 from kivy.uix.floatlayout import FloatLayout
+from kivy.uix.scatter import Scatter
 
 from .constants import HD
+from .lane import Lane
 from .lib.resources import get_filename
 
 Builder.load_file(get_filename("kv/mainwindow.kv"))
@@ -20,6 +21,10 @@ class MainWindow(FloatLayout):
         self._keyboard.bind(on_key_down=self._on_keyboard_down)
         # Window size
         self.check_window_size(Window.size)
+        # One lane per camera
+        self.lanes = []
+        self.app.bind(lanes=self.create_lanes)
+        self.create_lanes()
 
     def _keyboard_closed(self):
         """May be triggered by text inputs, so pass."""
@@ -47,7 +52,7 @@ class MainWindow(FloatLayout):
 
     def on_size(self, instance, size):
         self.check_window_size(size)
-        self.set_card_pos(size)
+        self.layout_lanes(size)
 
     def check_window_size(self, size):
         """Although camera is half HD, minimum window size is HD."""
@@ -57,14 +62,41 @@ class MainWindow(FloatLayout):
         else:
             self.app.is_minimum_size = False
 
-    def set_card_pos(self, size):
-        window_width, window_height = size
-        camera_width, camera_height = self.ids["camera"].size
-        card_width, card_height = self.ids["card"].size
-        # Head
-        head_radius = self.ids["body"].head_radius
-        # With arbitrary adjustments
-        x = self.center_x + int(head_radius / 2) + int(card_width / 2) + dp(12.5)
-        y = self.center_y - int(card_height / 2) - dp(50)
-        self.ids["card"].pos = (x, y)
-        self.ids["card_helper"].pos = (x, y)
+    def create_lanes(self, *args):
+        self.release_lanes()
+        container = self.ids["lanes"]
+        for index in range(len(self.app.lanes)):
+            lane = Lane(
+                app=self.app, lane=index, debug_character=self.ids["debug_character"]
+            )
+            # Scaled down, so lanes fit side by side
+            scatter = Scatter(
+                do_rotation=False,
+                do_scale=False,
+                do_translation=False,
+                size_hint=(None, None),
+            )
+            scatter.add_widget(lane)
+            container.add_widget(scatter)
+            self.lanes.append((scatter, lane))
+        self.layout_lanes(self.size)
+
+    def release_lanes(self):
+        """Stops each lane's camera, and its scan worker."""
+        for scatter, lane in self.lanes:
+            lane.ids["camera"].release()
+        self.ids["lanes"].clear_widgets()
+        self.lanes = []
+
+    def layout_lanes(self, size):
+        width, height = size
+        total_lanes = len(self.lanes)
+        for index, (scatter, lane) in enumerate(self.lanes):
+            scale = 1.0 / total_lanes
+            # Each lane is laid out at window size, then scaled
+            scatter.size = lane.size = (width, height)
+            scatter.scale = scale
+            scatter.pos = (
+                self.x + index * width * scale,
+                self.y + (height - height * scale) / 2,
+            )
@@ -1,6 +1,12 @@
 import datetime
 
-from kivy.clock import Clock
+import numpy as np
+import requests
+from kivy.clock import Clock, mainthread
+from kivy.graphics.texture import Texture
+
+from .lib.httpclient import get_result, http_client
+from .lib.metrics import stage_metrics
 
 
 class UTCMixin(object):
@@ -26,3 +32,65 @@ class NetworkRetryMixin(object):
         else:
             if callable(error):
                 error()
+
+
+class HTTPRequestMixin(object):
+    """Like UrlRequest, but with pooled keep-alive connections. Callbacks are
+    called on the main thread, with (response, result).
+
+    Not retried by the client, unless retries is passed, as callers retry with
+    retry_on_error, within a time budget."""
+
+    def http_request(
+        self, method, url, on_success=None, on_failure=None, on_error=None, **kwargs
+    ):
+        def done(future):
+            self.http_response(future, on_success, on_failure, on_error)
+
+        kwargs.setdefault("retries", 0)
+        http_client.submit(method, url, **kwargs).add_done_callback(done)
+
+    @mainthread
+    def http_response(self, future, on_success, on_failure, on_error):
+        try:
+            response = future.result()
+        except requests.RequestException as e:
+            # Network error
+            if callable(on_error):
+                on_error(None, e)
+        else:
+            if response.ok:
+                if callable(on_success):
+                    on_success(response, get_result(response))
+            elif callable(on_failure):
+                on_failure(response, get_result(response))
+
+
+class BlitFrameMixin(object):
+    """Blits BGR frames to an Image. The texture is allocated once per size, and
+    flipped with texture coordinates, so nothing is allocated per frame."""
+
+    frame_texture = None
+
+    def blit_frame(self, frame):
+        with stage_metrics.time("blit"):
+            self.blit_frame_texture(frame)
+
+    def blit_frame_texture(self, frame):
+        height, width = frame.shape[:2]
+        texture = self.frame_texture
+        if texture is None or texture.size != (width, height):
+            texture = Texture.create(size=(width, height), colorfmt="bgr")
+            # Same as cv2.flip(frame, -1)
+            texture.flip_vertical()
+            texture.flip_horizontal()
+            self.frame_texture = texture
+        # Crops are not contiguous
+        if not frame.flags["C_CONTIGUOUS"]:
+            frame = np.ascontiguousarray(frame)
+        # Buffer protocol, without a bytes copy
+        texture.blit_buffer(frame.reshape(-1), colorfmt="bgr", bufferfmt="ubyte")
+        if self.texture is not texture:
+            self.texture = texture
+        else:
+            self.canvas.ask_update()
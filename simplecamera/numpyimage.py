@@ -1,8 +1,8 @@
-import cv2
-from kivy.graphics.texture import Texture
 from kivy.lang import Builder
 from kivy.uix.image import Image
 
+from .mixins import BlitFrameMixin
+
 Builder.load_string(
     """
 <KivyOutputImage>:
@@ -12,10 +12,5 @@ Builder.load_string(
 )
 
 
-class KivyNumpyImage(Image):
-    def blit_frame(self, frame):
-        frame = cv2.flip(frame, -1)
-        data = frame.tostring()
-        texture = Texture.create(size=(frame.shape[1], frame.shape[0]), colorfmt="bgr")
-        texture.blit_buffer(data, colorfmt="bgr", bufferfmt="ubyte")
-        self.texture = texture
+class KivyNumpyImage(BlitFrameMixin, Image):
+    pass
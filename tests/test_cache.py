@@ -0,0 +1,66 @@
+import pytest
+
+from simplecamera.lib import cache
+from simplecamera.lib.cache import TTLCache, get_max_age
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+def test_entries_expire(clock):
+    users = TTLCache(ttl=60)
+    users.set("12345678", {"line_1": "a"})
+    users.set("87654321", {"line_1": "b"}, ttl=10)
+    clock.now += 30
+    assert users.get("12345678") == {"line_1": "a"}
+    assert users.get("87654321") is None
+    # Expired entries are dropped
+    assert len(users) == 1
+    assert (users.hits, users.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted(clock):
+    users = TTLCache(maxsize=2)
+    users.set("1", "a")
+    users.set("2", "b")
+    users.get("1")
+    users.set("3", "c")
+    assert users.get("2") is None
+    assert users.get("1") == "a"
+    assert users.get("3") == "c"
+
+
+def test_remove(clock):
+    users = TTLCache()
+    users.set("1", "a")
+    users.remove("1")
+    users.remove("2")
+    assert users.get("1") is None
+
+
+@pytest.mark.parametrize(
+    "cache_control, max_age",
+    [
+        ("max-age=300", 300),
+        ("private, Max-Age=60", 60),
+        ("no-store", 0),
+        ("no-cache, max-age=300", 0),
+        ("private", None),
+        (None, None),
+    ],
+)
+def test_get_max_age(cache_control, max_age):
+    headers = {} if cache_control is None else {"Cache-Control": cache_control}
+    assert get_max_age(headers) == max_age
@@ -0,0 +1,184 @@
+import datetime
+import json
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Full, Queue
+
+import numpy as np
+import pytest
+
+from simplecamera.lib.cardscan import OVERFLOW_REJECT, CardScanUploader
+from simplecamera.lib.spool import CardScanSpool
+
+
+class CardScanHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        self.rfile.read(length)
+        self.server.requests.append(dict(self.headers))
+        # Saved, but answered slowly
+        time.sleep(self.server.delay)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = json.dumps({"sound": "success"}).encode("utf8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The uploader timed out
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CardScanHandler)
+    server.requests = []
+    server.statuses = []
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def uploader(request, tmp_path):
+    spool = CardScanSpool(str(tmp_path / "cardscan.sqlite3"))
+    kwargs = {"retry_interval": 0.05, "max_retry_interval": 0.1}
+    kwargs.update(getattr(request, "param", {}))
+    uploader = CardScanUploader(spool, **kwargs)
+    uploader.start()
+    yield uploader
+    uploader.stop()
+
+
+def get_url(server):
+    return "http://127.0.0.1:{}/jinjuku-card/save/".format(server.server_port)
+
+
+def submit(uploader, jpg=None):
+    if jpg is None:
+        frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+        jpg = uploader.encode(frame)
+    responses = Queue()
+    key = uploader.submit(
+        "12345678 password",
+        datetime.datetime.utcnow(),
+        False,
+        jpg,
+        callback=lambda key, data: responses.put((key, data)),
+    )
+    return key, responses
+
+
+def test_upload(server, uploader):
+    uploader.set_request(get_url(server), {"Authorization": "Token a"})
+    key, responses = submit(uploader)
+    assert responses.get(timeout=5) == (key, {"sound": "success"})
+    assert uploader.spool.count() == 0
+    assert server.requests[0]["Authorization"] == "Token a"
+
+
+def test_spooled_scans_use_the_current_token(server, uploader):
+    key, responses = submit(uploader)
+    assert responses.empty()
+    uploader.set_request(get_url(server), {"Authorization": "Token b"})
+    assert responses.get(timeout=5) == (key, {"sound": "success"})
+    assert server.requests[0]["Authorization"] == "Token b"
+
+
+def test_server_error_is_retried(server, uploader):
+    server.statuses = [503, 401]
+    uploader.set_request(get_url(server), {"Authorization": "Token a"})
+    key, responses = submit(uploader)
+    # Notified once, on the first failure
+    assert responses.get(timeout=5) == (key, {"network_error": True})
+    for i in range(50):
+        if uploader.spool.count() == 0:
+            break
+        time.sleep(0.1)
+    assert len(server.requests) == 3
+    assert uploader.spool.count() == 0
+
+
+@pytest.mark.parametrize("uploader", [{"max_retry_interval": 5}], indirect=True)
+def test_client_error_is_kept(server, uploader):
+    server.statuses = [400]
+    uploader.set_request(get_url(server), {"Authorization": "Token a"})
+    key, responses = submit(uploader)
+    assert responses.get(timeout=5) == (key, {"upload_error": 400})
+    assert uploader.spool.count() == 1
+
+
+@pytest.mark.parametrize(
+    "uploader",
+    [{"timeout": 0.5, "max_retry_interval": 5, "notify_after": 1}],
+    indirect=True,
+)
+def test_read_timeout_is_retried_with_the_same_key(server, uploader):
+    server.delay = 1.0
+    uploader.set_request(get_url(server), {"Authorization": "Token a"})
+    key, responses = submit(uploader)
+    assert responses.get(timeout=5) == (key, {"network_error": True})
+    time.sleep(1)
+    # May have been saved, so not retried immediately
+    assert len(server.requests) == 1
+    assert server.requests[0]["Idempotency-Key"] == key
+    assert uploader.spool.count() == 1
+
+
+def test_failed_encode_only_drops_the_scan(server, uploader):
+    uploader.set_request(get_url(server), {"Authorization": "Token a"})
+    jpg = Future()
+    jpg.set_exception(ValueError("JPEG encoding failed"))
+    key, responses = submit(uploader, jpg=jpg)
+    assert responses.get(timeout=5) == (key, {"scan_error": True})
+    assert uploader.is_alive()
+    # Later scans are still uploaded
+    key, responses = submit(uploader)
+    assert responses.get(timeout=5) == (key, {"sound": "success"})
+
+
+@pytest.mark.parametrize("uploader", [{"max_pending": 1}], indirect=True)
+def test_overflow_is_spooled_without_waiting(server, uploader):
+    uploader.set_request(get_url(server), {"Authorization": "Token a"})
+    # Not yet encoded, so the caller mustn't wait for it
+    jpgs = [Future() for i in range(20)]
+    submits = [submit(uploader, jpg=jpg) for jpg in jpgs]
+    assert uploader.overflowed_scans > 0
+    for jpg in jpgs:
+        jpg.set_result(b"jpg")
+    for key, responses in submits:
+        assert responses.get(timeout=5) == (key, {"sound": "success"})
+
+
+@pytest.mark.parametrize(
+    "uploader", [{"max_pending": 1, "overflow": OVERFLOW_REJECT}], indirect=True
+)
+def test_overflow_is_rejected(uploader):
+    jpg = Future()
+    submit(uploader, jpg=jpg)
+    with pytest.raises(Full):
+        for i in range(20):
+            submit(uploader, jpg=jpg)
+    jpg.set_result(b"jpg")
+
+
+def test_stop_spools_submitted_scans(tmp_path):
+    path = str(tmp_path / "cardscan.sqlite3")
+    uploader = CardScanUploader(CardScanSpool(path))
+    uploader.start()
+    submit(uploader)
+    uploader.stop()
+    assert not uploader.is_alive()
+    spool = CardScanSpool(path)
+    assert spool.count() == 1
+    spool.close()
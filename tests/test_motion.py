@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from simplecamera.lib import motion
+from simplecamera.lib.motion import ChangeDetector
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(motion, "time", clock)
+    return clock
+
+
+def get_segment(value):
+    return np.full((240, 320, 3), value, dtype=np.uint8)
+
+
+def test_first_segment_has_changed(clock):
+    detector = ChangeDetector()
+    assert detector.has_changed(get_segment(0))
+
+
+def test_still_segment_is_gated_after_hold(clock):
+    detector = ChangeDetector(hold_time=1.0)
+    detector.has_changed(get_segment(0))
+    clock.now += 0.5
+    # Held
+    assert detector.has_changed(get_segment(0))
+    clock.now += 1.0
+    assert not detector.has_changed(get_segment(0))
+    assert detector.gated_frames == 1
+
+
+def test_change_after_gating(clock):
+    detector = ChangeDetector(hold_time=1.0)
+    detector.has_changed(get_segment(0))
+    clock.now += 2.0
+    assert not detector.has_changed(get_segment(0))
+    assert detector.has_changed(get_segment(200))
+
+
+def test_grayscale_segment(clock):
+    detector = ChangeDetector(hold_time=0)
+    detector.has_changed(np.zeros((240, 320), dtype=np.uint8))
+    clock.now += 1.0
+    assert not detector.has_changed(np.zeros((240, 320), dtype=np.uint8))
+    assert detector.has_changed(np.full((240, 320), 200, dtype=np.uint8))
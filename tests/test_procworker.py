@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from simplecamera.lib.procworker import SharedFrameRing
+
+SHAPE = (36, 64, 3)
+
+
+@pytest.fixture
+def ring():
+    ring = SharedFrameRing(slots=3, shape=SHAPE)
+    yield ring
+    ring.close()
+
+
+def get_frame(value):
+    return np.full(SHAPE, value, dtype=np.uint8)
+
+
+def test_frame_is_read_back(ring):
+    ring.write(1, 7, get_frame(7))
+    assert (ring.read(1, 7) == 7).all()
+
+
+def test_empty_slot_is_not_read(ring):
+    assert ring.read(0, 0) is None
+
+
+def test_overwritten_slot_is_not_read(ring):
+    ring.write(0, 1, get_frame(1))
+    ring.write(0, 4, get_frame(4))
+    assert ring.read(0, 1) is None
+    assert (ring.read(0, 4) == 4).all()
+
+
+def test_attached_ring_shares_frames(ring):
+    attached = SharedFrameRing(slots=3, shape=SHAPE, name=ring.name)
+    try:
+        ring.write(2, 5, get_frame(5))
+        assert (attached.read(2, 5) == 5).all()
+        ring.write(2, 8, get_frame(8))
+        assert attached.read(2, 5) is None
+    finally:
+        attached.close()
@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+
+from simplecamera.lib.buffers import BufferPool
+from simplecamera.lib.qrlocate import locate_qrcodes, pad_box
+
+
+def get_qrcode(size):
+    qrcode = cv2.QRCodeEncoder.create().encode("12345678 abcd")
+    return cv2.resize(qrcode, (size, size), interpolation=cv2.INTER_NEAREST)
+
+
+def get_gray(x, y, size=200):
+    gray = np.full((720, 1280), 128, dtype=np.uint8)
+    gray[y : y + size, x : x + size] = get_qrcode(size)
+    return gray
+
+
+def contains(box, rect):
+    x, y, w, h = box
+    rect_x, rect_y, rect_w, rect_h = rect
+    return (
+        x <= rect_x
+        and y <= rect_y
+        and x + w >= rect_x + rect_w
+        and y + h >= rect_y + rect_h
+    )
+
+
+def test_qrcode_is_located():
+    boxes = locate_qrcodes(get_gray(600, 300))
+    assert boxes
+    assert contains(boxes[0], (600, 300, 200, 200))
+
+
+def test_blank_frame_has_no_candidates():
+    gray = np.full((720, 1280), 128, dtype=np.uint8)
+    assert locate_qrcodes(gray) == []
+
+
+def test_small_qrcode_is_ignored():
+    gray = get_gray(600, 300, size=60)
+    assert locate_qrcodes(gray, min_size=100) == []
+
+
+def test_pool_is_reused():
+    pool = BufferPool()
+    first = locate_qrcodes(get_gray(600, 300), pool=pool)
+    assert locate_qrcodes(get_gray(600, 300), pool=pool) == first
+
+
+def test_pad_box_is_clipped():
+    assert pad_box((100, 100, 100, 100), 0.2, 1280, 720) == (80, 80, 140, 140)
+    assert pad_box((0, 650, 100, 70), 0.2, 1280, 720) == (0, 636, 120, 84)
@@ -0,0 +1,68 @@
+import pytest
+
+from simplecamera.lib import qrvote
+from simplecamera.lib.qrvote import QRCodeVoter
+
+POLYGON = [(100, 100), (100, 200), (200, 200), (200, 100)]
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(qrvote, "time", clock)
+    return clock
+
+
+def shift(polygon, dx, dy=0):
+    return [(x + dx, y + dy) for x, y in polygon]
+
+
+def test_clean_read_is_accepted(clock):
+    voter = QRCodeVoter()
+    assert voter.vote("12345678 abcd", POLYGON, is_clean=True)
+    assert voter.accepted == 1
+
+
+def test_read_that_isnt_clean_needs_votes(clock):
+    voter = QRCodeVoter(min_votes=2)
+    assert not voter.vote("12345678 abcd", POLYGON, is_clean=False)
+    clock.now += 0.1
+    assert voter.vote("12345678 abcd", POLYGON, is_clean=False)
+    assert voter.rejected == 1
+    assert voter.accepted == 1
+
+
+def test_other_data_doesnt_vote(clock):
+    voter = QRCodeVoter(min_votes=2)
+    voter.vote("12345678 abcd", POLYGON, is_clean=False)
+    assert not voter.vote("87654321 dcba", POLYGON, is_clean=False)
+
+
+def test_old_candidates_dont_vote(clock):
+    voter = QRCodeVoter(min_votes=2, max_age=1.0)
+    voter.vote("12345678 abcd", POLYGON, is_clean=False)
+    clock.now += 1.5
+    assert not voter.vote("12345678 abcd", POLYGON, is_clean=False)
+
+
+def test_shifted_candidates_dont_vote(clock):
+    voter = QRCodeVoter(min_votes=2, max_shift=50)
+    voter.vote("12345678 abcd", POLYGON, is_clean=False)
+    assert not voter.vote("12345678 abcd", shift(POLYGON, 51), is_clean=False)
+    # Within max_shift of the last candidate
+    assert voter.vote("12345678 abcd", shift(POLYGON, 80, 30), is_clean=False)
+
+
+def test_reset(clock):
+    voter = QRCodeVoter(min_votes=2)
+    voter.vote("12345678 abcd", POLYGON, is_clean=False)
+    voter.reset()
+    assert not voter.vote("12345678 abcd", POLYGON, is_clean=False)
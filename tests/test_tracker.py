@@ -0,0 +1,57 @@
+import pytest
+
+from simplecamera.lib import tracker
+from simplecamera.lib.tracker import RegionTracker
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(tracker, "time", clock)
+    return clock
+
+
+def test_window_is_padded_and_clipped(clock):
+    region = RegionTracker(pad=0.5)
+    assert region.get_window(640, 360) is None
+    region.hit((100, 100, 40, 20))
+    assert region.get_window(640, 360) == (80, 90, 80, 40)
+    region.hit((10, 340, 40, 20))
+    assert region.get_window(640, 360) == (0, 330, 70, 30)
+
+
+def test_reset_after_max_misses(clock):
+    region = RegionTracker(max_misses=3)
+    region.hit((100, 100, 40, 40))
+    region.miss()
+    region.miss()
+    assert region.get_window(640, 360) is not None
+    region.miss()
+    assert region.get_window(640, 360) is None
+
+
+def test_hit_resets_misses(clock):
+    region = RegionTracker(max_misses=2)
+    region.hit((100, 100, 40, 40))
+    region.miss()
+    region.hit((100, 100, 40, 40))
+    region.miss()
+    assert region.get_window(640, 360) is not None
+
+
+def test_reset_after_max_age(clock):
+    region = RegionTracker(max_age=2.0)
+    region.hit((100, 100, 40, 40))
+    clock.now += 1.5
+    assert region.get_window(640, 360) is not None
+    clock.now += 1.0
+    assert region.get_window(640, 360) is None
+    assert region.rect is None